@@ -74,9 +74,18 @@ def get_python_version(numerical=False):
         pyvers='v%s.%s.%s' % sys.version_info[0:3]
     return pyvers
 
+from . import dbpool
+from . import querycache
 from . import files
+from . import manifest
+from . import pathtemplates
+from . import redinfo
+from . import binpack
 from . import generic
+from . import walltime
 from . import modules
+from . import check
+from . import executor
 
 from . import desmeds
 
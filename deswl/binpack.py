@@ -0,0 +1,116 @@
+"""
+Pack jobs into bins of roughly equal predicted cost, e.g. one bin per node.
+
+Jobs are grouped by a locality key, such as the MEDS file, and whole groups
+are assigned to bins, most expensive first, each to the least loaded bin.
+Groups more expensive than the mean bin load are first split into contiguous
+pieces so the bins can still be balanced.  Within a bin, jobs with the same
+key are kept together in their input order.
+"""
+import heapq
+
+def pack(costs, keys, nbins):
+    """
+    Pack jobs into bins
+
+    parameters
+    ----------
+    costs: sequence
+        The predicted cost of each job, e.g. seconds
+    keys: sequence
+        The locality key for each job
+    nbins: int
+        Number of bins
+
+    returns
+    -------
+    bins, loads: A list of nbins lists of job indices and the total cost
+    of each bin.  Some bins may be empty if there are few jobs
+    """
+    if nbins < 1:
+        raise ValueError("nbins must be >= 1, got %s" % nbins)
+
+    if len(costs) != len(keys):
+        raise ValueError("costs and keys must be same length, "
+                         "got %d and %d" % (len(costs),len(keys)))
+
+    groups=get_groups(keys)
+
+    total=float(sum(costs))
+    target=total/nbins
+
+    pieces=[]
+    for group in groups:
+        pieces += split_group(group, costs, target)
+
+    piece_costs=[sum(costs[i] for i in piece) for piece in pieces]
+    order=sorted(range(len(pieces)), key=lambda i: -piece_costs[i])
+
+    # heap of (load, ibin)
+    heap=[(0.0, ibin) for ibin in xrange(nbins)]
+    bin_pieces=[[] for ibin in xrange(nbins)]
+    loads=[0.0]*nbins
+    for ipiece in order:
+        load,ibin=heapq.heappop(heap)
+        bin_pieces[ibin].append(pieces[ipiece])
+        load += piece_costs[ipiece]
+        loads[ibin]=load
+        heapq.heappush(heap, (load, ibin))
+
+    bins=[]
+    for plist in bin_pieces:
+        plist.sort(key=lambda piece: piece[0])
+        ind=[]
+        for piece in plist:
+            ind += piece
+        bins.append(ind)
+
+    return bins, loads
+
+def get_groups(keys):
+    """
+    group the job indices by key, in order of first appearance
+    """
+    groups={}
+    order=[]
+    for i,key in enumerate(keys):
+        if key not in groups:
+            groups[key]=[]
+            order.append(key)
+        groups[key].append(i)
+
+    return [groups[key] for key in order]
+
+def split_group(group, costs, target):
+    """
+    split a group of job indices into contiguous pieces with cost no more
+    than the target, unless a single job is more expensive
+    """
+    pieces=[]
+    piece=[]
+    piece_cost=0.0
+    for i in group:
+        cost=costs[i]
+        if len(piece) > 0 and (piece_cost+cost) > target:
+            pieces.append(piece)
+            piece=[]
+            piece_cost=0.0
+
+        piece.append(i)
+        piece_cost += cost
+
+    if len(piece) > 0:
+        pieces.append(piece)
+
+    return pieces
+
+def get_efficiency(loads):
+    """
+    mean load over the max load; 1 is perfectly balanced
+    """
+    if len(loads)==0:
+        return 0.0
+    maxload=max(loads)
+    if maxload <= 0:
+        return 0.0
+    return sum(loads)/float(len(loads))/maxload
@@ -0,0 +1,824 @@
+"""
+Check the outputs of the jobs in a run.
+
+bin/deswl-check runs process_status for a single meta file.  The RunChecker
+checks a whole run in one process
+
+    deswl-check --run $run
+
+The flists are generated once, each output directory is listed once rather
+than running a stat for every expected file, and the status files are read
+by a pool of threads.  The goodlist and badlist are written directly to the
+collated directory for the run.
+
+The CheckReducer collates the json files written by the per-job checkers
+
+    deswl-check-reduce $run
+
+The files are read and parsed by a pool of processes and the results are
+streamed to the goodlist and badlist as they arrive, so memory use does not
+grow with the size of the run.
+
+Both keep a state table for the run in an sqlite database
+
+    $DESDATA/wlpipe/{run}/check/{run}-check-state.db
+
+holding the last verdict and result for each job, along with the mtime and
+size of the files it depends on.  On later passes only jobs whose files
+changed are re-evaluated.  Send full=True, or --full on the command line, to
+re-evaluate all jobs.
+"""
+import os
+import glob
+import json
+import time
+import sqlite3
+import multiprocessing
+from sys import stderr
+from multiprocessing.pool import ThreadPool
+
+import esutil as eu
+from esutil.io import fexists
+import desdb
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir=None
+
+from .generic import NTHREADS
+from .manifest import BATCH_SIZE, get_job_key
+from . import modules
+
+def process_status(info, verbose=False, exists=fexists, read_status=None):
+    """
+    Check the exit status and output files for a job, setting the
+    'error_string' and 'missing' entries in info
+
+    parameters
+    ----------
+    info: dict
+        The job meta data, with the 'output_files' entry
+    verbose: bool, optional
+        Print the names of files as they are checked
+    exists: function, optional
+        Function to test for the existence of a file, default fexists
+    read_status: function, optional
+        Function to get the text of the status file, default is to
+        read the file
+    """
+    if read_status is None:
+        read_status=read_status_file
+
+    info['error_string'] = ''
+    info['missing']=[]
+
+    status_file=info['output_files']['status']
+
+    if not exists(status_file):
+        info['error_string'] = 'status file not found'
+    else:
+
+        stat_read=False
+        try:
+            if verbose:
+                print >>stderr,'    reading:',status_file
+
+            exit_status=int(read_status(status_file))
+
+            info['exit_status'] = exit_status
+            stat_read=True
+        except ValueError as e:
+            print >>stderr,"Error reading stat file:",status_file
+            info['error_string'] = 'Error reading stat file'
+
+        if stat_read:
+            exit_status= info['exit_status']
+            if exit_status != 0:
+                print >>stderr,"Found non-zero exit status %s in stat file" \
+                        % exit_status
+                info['error_string'] = 'Processing error'
+            else:
+                missing_types=[]
+                missing=[]
+                for ftype,f in info['output_files'].iteritems():
+                    if ftype=='qa':
+                        continue
+                    if verbose:
+                        print >>stderr,'    checking:',f
+                    if not exists(f):
+                        # only print first missing one
+                        if len(missing) == 0:
+                            print >>stderr,'file missing:',f
+                        missing_types.append(ftype)
+                        missing.append(f)
+
+                if len(missing_types) > 0:
+                    fmiss=' '.join(missing_types)
+                    info['error_string'] = 'files missing: %s' % fmiss
+                info['missing']=missing
+
+    return info
+
+def read_status_file(fname):
+    """
+    read the text of a status file
+    """
+    with open(fname) as fobj:
+        return fobj.read()
+
+def list_dir(dirname):
+    """
+    list the names of the files in a directory.  An empty list is
+    returned if the directory does not exist
+    """
+    try:
+        if scandir is not None:
+            return [entry.name for entry in scandir(dirname)]
+        else:
+            return os.listdir(dirname)
+    except OSError:
+        return []
+
+def stat_dir(dirname):
+    """
+    list the files in a directory, returning a list of (name, sig) where sig
+    is the (mtime, size) of the file.  An empty list is returned if the
+    directory does not exist
+    """
+    if scandir is not None:
+        try:
+            entries=list(scandir(dirname))
+        except OSError:
+            return []
+
+        names=[entry.name for entry in entries]
+        stats=[]
+        for entry in entries:
+            try:
+                stats.append(entry.stat())
+            except OSError:
+                stats.append(None)
+    else:
+        names=list_dir(dirname)
+        stats=[]
+        for name in names:
+            try:
+                stats.append(os.stat(os.path.join(dirname,name)))
+            except OSError:
+                stats.append(None)
+
+    res=[]
+    for name,st in zip(names,stats):
+        if st is not None:
+            res.append( (name, (st.st_mtime, st.st_size)) )
+    return res
+
+def file_sig(fname):
+    """
+    the (mtime, size) of the file, or None if it does not exist
+    """
+    try:
+        st=os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def get_check_state_dir(run):
+    df=desdb.files.DESFiles()
+    d=df.dir(type='wlpipe_run', run=run)
+    return os.path.join(d, 'check')
+
+def get_check_state_url(run):
+    d=get_check_state_dir(run)
+    name='%s-check-state.db' % run
+    return os.path.join(d, name)
+
+class CheckState(object):
+    """
+    The check state for a run, a table holding the last verdict for each job
+    along with a signature of the files it depends on
+
+    parameters
+    ----------
+    path: string
+        Path to the sqlite database, created if it does not exist
+    table: string
+        Name of the table, e.g. 'jobs' for the run checker or 'check_files'
+        for the reducer
+    """
+    def __init__(self, path, table):
+        self.path=path
+        self.table=table
+
+        d=os.path.dirname(path)
+        if d != '' and not os.path.exists(d):
+            print >>stderr,'making dir:',d
+            os.makedirs(d)
+
+        self.conn=sqlite3.connect(path)
+        self._pending=[]
+        self._create()
+
+    def get_sigs(self):
+        """
+        get a dict keyed by job key with the signature for each job
+        """
+        q='select key, sig from %s' % self.table
+        curs=self.conn.cursor()
+        curs.execute(q)
+        sigs=dict(curs.fetchall())
+        curs.close()
+        return sigs
+
+    def iter_results(self):
+        """
+        iterate over (key, good, result) for all jobs
+        """
+        q='select key, good, result from %s' % self.table
+        curs=self.conn.cursor()
+        curs.execute(q)
+        for key,good,result in curs:
+            yield key, bool(good), result
+        curs.close()
+
+    def add(self, key, sig, good, result):
+        """
+        add or replace the state for a job.  The sig is a json string, the
+        result the json encoded result.  Inserts are done in batches
+        """
+        self._pending.append( (key, sig, int(good), result) )
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        insert any pending jobs
+        """
+        if len(self._pending) == 0:
+            return
+
+        q='insert or replace into %s values (?, ?, ?, ?)' % self.table
+        curs=self.conn.cursor()
+        curs.executemany(q, self._pending)
+        curs.close()
+        self.conn.commit()
+
+        self._pending=[]
+
+    def retain(self, keys):
+        """
+        remove jobs that are not in the input keys
+        """
+        self.flush()
+
+        curs=self.conn.cursor()
+        curs.execute('create temp table keep (key text primary key)')
+        curs.executemany('insert or ignore into keep values (?)',
+                         ((key,) for key in keys))
+        q='delete from %s where key not in (select key from keep)'
+        curs.execute(q % self.table)
+        curs.execute('drop table keep')
+        curs.close()
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _create(self):
+        q="""
+create table if not exists %s (
+    key text primary key,
+    sig text,
+    good integer,
+    result text
+)
+        """ % self.table
+        curs=self.conn.cursor()
+        curs.execute(q)
+        curs.close()
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+class RunChecker(dict):
+    """
+    Check all jobs in a run and write the goodlist and badlist
+
+    parameters
+    ----------
+    run: string
+        The run identifier
+    master: bool, optional
+        The run was written in master mode.  Default False
+    nthreads: int, optional
+        Number of threads for listing directories and reading
+        status files, default NTHREADS
+    verbose: bool, optional
+        Print the names of files as they are checked
+    full: bool, optional
+        Re-evaluate all jobs, not just those with changed files.  The
+        state table is still updated.  Default False
+    """
+    def __init__(self, run, master=False, nthreads=NTHREADS, verbose=False,
+                 full=False):
+        self['run']=run
+        self['master']=master
+        self['nthreads']=nthreads
+        self['verbose']=verbose
+        self['full']=full
+
+        self.cfobj,self.is_se=modules.get_scripts_maker(run, master=master)
+
+        self._listed=set()
+        self._stats={}
+        self._status={}
+
+    def go(self):
+        """
+        check all jobs, setting the goodlist and badlist
+        """
+        tm0=time.time()
+
+        jobs=self.get_jobs()
+        print >>stderr,'checking',len(jobs),'jobs'
+
+        self._list_dirs(jobs)
+
+        with CheckState(get_check_state_url(self['run']), 'jobs') as state:
+            if self['full']:
+                prev={}
+            else:
+                prev=state.get_sigs()
+
+            sigs=[self.get_sig(info) for info in jobs]
+            keys=[info['output_files']['status'] for info in jobs]
+
+            todo=[]
+            for info,key,sig in zip(jobs,keys,sigs):
+                if sig is None or prev.get(key) != sig:
+                    todo.append(info)
+
+            print >>stderr,'re-evaluating',len(todo),'jobs'
+            self._read_all_status(todo)
+            todo=set(id(info) for info in todo)
+
+            results={}
+            if len(todo) < len(jobs):
+                for key,good,result in state.iter_results():
+                    results[key]=result
+
+            goodlist=[]
+            badlist=[]
+            for info,key,sig in zip(jobs,keys,sigs):
+                if id(info) in todo:
+                    info=process_status(info,
+                                        verbose=self['verbose'],
+                                        exists=self.exists,
+                                        read_status=self._status.__getitem__)
+                    if sig is not None:
+                        state.add(key, sig, info['error_string']=='',
+                                  json.dumps(info))
+                else:
+                    info=json.loads(results[key])
+
+                if info['error_string'] == '':
+                    goodlist.append(info)
+                else:
+                    badlist.append(info)
+
+            state.retain(keys)
+
+        self.goodlist=goodlist
+        self.badlist=badlist
+
+        print >>stderr,"Found %s/%s problems" % (len(badlist),len(jobs))
+        print >>stderr,'time: %.1f seconds' % (time.time()-tm0,)
+
+    def write(self):
+        """
+        write the goodlist and badlist to the collated dir for the run
+        """
+        df=desdb.files.DESFiles()
+        goodfile=df.url(type='wlpipe_collated_goodlist', run=self['run'])
+        badfile=df.url(type='wlpipe_collated_badlist', run=self['run'])
+
+        eu.ostools.makedirs_fromfile(goodfile)
+
+        print >>stderr,"Writing goodlist:",goodfile
+        eu.io.write(goodfile,self.goodlist,clobber=True)
+        print >>stderr,"Writing badlist:",badfile
+        eu.io.write(badfile,self.badlist,clobber=True)
+
+    def get_jobs(self):
+        """
+        get the info dict for each job, as would be read from
+        the meta files
+        """
+        cfobj=self.cfobj
+        use_manifest=cfobj.use_manifest()
+        if use_manifest:
+            manifest=cfobj.get_manifest_url()
+
+        jobs=[]
+        for fd in cfobj.get_flists():
+            fd['run'] = self['run']
+            cfobj.set_job_files(fd)
+
+            if use_manifest:
+                del fd['output_files']['meta']
+                jobid=get_job_key(fd)
+                fd['meta'] = '%s:%s' % (manifest, jobid)
+            else:
+                fd['meta'] = fd['output_files']['meta']
+
+            jobs.append(fd)
+
+        return jobs
+
+    def get_sig(self, info):
+        """
+        get the signature of the status and output files for a job, a json
+        string holding the (mtime, size) for each file, null for missing
+        files.  None is returned if any of the directories were not listed,
+        and the job will always be re-evaluated
+        """
+        outf=info['output_files']
+        sig=[]
+        for ftype in sorted(outf):
+            f=outf[ftype]
+            if f in self._stats:
+                sig.append(self._stats[f])
+            elif os.path.dirname(f) in self._listed:
+                sig.append(None)
+            else:
+                return None
+
+        return json.dumps(sig)
+
+    def exists(self, fname):
+        """
+        check for existence using the directory listings, falling back
+        to fexists for directories not listed, e.g. in hdfs
+        """
+        if fname in self._stats:
+            return True
+
+        dirname=os.path.dirname(fname)
+        if dirname in self._listed:
+            return False
+
+        return fexists(fname)
+
+    def _list_dirs(self, jobs):
+        """
+        list each directory holding outputs once, getting the mtime and
+        size for each file
+        """
+        dirs=set()
+        for info in jobs:
+            for f in info['output_files'].itervalues():
+                if f is None or f.startswith('hdfs://'):
+                    continue
+                dirs.add(os.path.dirname(f))
+
+        dirs=sorted(dirs)
+        print >>stderr,'listing',len(dirs),'directories'
+
+        pool=ThreadPool(self['nthreads'])
+        try:
+            listings=pool.map(stat_dir, dirs)
+        finally:
+            pool.close()
+            pool.join()
+
+        for dirname,listing in zip(dirs,listings):
+            self._listed.add(dirname)
+            for name,sig in listing:
+                self._stats[os.path.join(dirname,name)] = sig
+
+    def _read_all_status(self, jobs):
+        """
+        read the existing status files in bulk
+        """
+        fnames=[info['output_files']['status'] for info in jobs]
+        fnames=[f for f in fnames if self.exists(f)]
+
+        print >>stderr,'reading',len(fnames),'status files'
+
+        pool=ThreadPool(self['nthreads'])
+        try:
+            texts=pool.map(_read_status_nothrow, fnames, chunksize=100)
+        finally:
+            pool.close()
+            pool.join()
+
+        self._status=dict(zip(fnames,texts))
+
+def _read_status_nothrow(fname):
+    """
+    return an empty string for files that could not be read, this will be
+    reported as an error reading the status file
+    """
+    try:
+        return read_status_file(fname)
+    except IOError:
+        return ''
+
+# seconds between progress reports
+PROGRESS_INTERVAL=10.0
+
+class CheckReducer(dict):
+    """
+    Collate the check json files for a run into the goodlist and badlist
+
+    parameters
+    ----------
+    run: string
+        The run identifier
+    nprocs: int, optional
+        Number of processes for reading the check files.  Default
+        is the number of cpus
+    format: string, optional
+        'json' to write a json list, readable with eu.io.read, or 'ndjson'
+        to write one json object per line.  Default 'json'
+    expected: int, optional
+        The expected number of check files.  If sent and a different
+        number is found, a ValueError is raised after writing
+    dir: string, optional
+        The directory holding the check files, default is the directory
+        of the reduce script for the run
+    full: bool, optional
+        Re-read all check files, not just those that changed since the
+        last pass.  Default False
+    """
+    def __init__(self, run, nprocs=None, format='json', expected=None,
+                 dir=None, chunksize=100, full=False):
+        if format not in ['json','ndjson']:
+            raise ValueError("format should be 'json' or 'ndjson', "
+                             "got '%s'" % format)
+        if nprocs is None:
+            nprocs=multiprocessing.cpu_count()
+
+        self['run']=run
+        self['nprocs']=nprocs
+        self['format']=format
+        self['expected']=expected
+        self['chunksize']=chunksize
+        self['full']=full
+
+        self._df=desdb.files.DESFiles()
+        if dir is None:
+            f=self._df.url('wlpipe_check_reduce', run=run)
+            dir=os.path.dirname(f)
+        self['dir']=dir
+
+    def go(self):
+        """
+        read all check files and write the goodlist and badlist
+        """
+        goodfile,badfile=self.get_collated_urls()
+        eu.ostools.makedirs_fromfile(goodfile)
+
+        print >>stderr,'reading check files from:',self['dir']
+
+        tm0=time.time()
+        ngood=0
+        nbad=0
+
+        # start the pool before opening the state database
+        pool=multiprocessing.Pool(self['nprocs'])
+        try:
+            state_url=get_check_state_url(self['run'])
+            with CheckState(state_url, 'check_files') as state:
+                files,sigs=self._get_sigs()
+                changed=self._get_changed(state, files, sigs)
+
+                print >>stderr,'found',len(files),'check files,', \
+                        len(changed),'changed'
+
+                with CollatedWriter(goodfile, self['format']) as good, \
+                        CollatedWriter(badfile, self['format']) as bad:
+
+                    # previous results for files that did not change
+                    for fname,isgood,text in state.iter_results():
+                        if fname in sigs and fname not in changed:
+                            if isgood:
+                                good.write(text)
+                                ngood+=1
+                            else:
+                                bad.write(text)
+                                nbad+=1
+
+                    tlast=time.time()
+                    results=pool.imap_unordered(_reduce_one, changed,
+                                                self['chunksize'])
+                    for fname,isgood,text,message in results:
+                        if isgood:
+                            good.write(text)
+                            ngood+=1
+                        else:
+                            print >>stderr,message
+                            bad.write(text)
+                            nbad+=1
+
+                        state.add(fname, changed[fname], isgood, text)
+
+                        tnow=time.time()
+                        if (tnow-tlast) > PROGRESS_INTERVAL:
+                            self._report(ngood, nbad, tnow-tm0)
+                            tlast=tnow
+
+                state.retain(files)
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        ntot=ngood+nbad
+        self._report(ngood, nbad, time.time()-tm0)
+        print >>stderr,"Found %s/%s problems" % (nbad,ntot)
+        print >>stderr,"Wrote goodlist:",goodfile
+        print >>stderr,"Wrote badlist:",badfile
+
+        self['ngood']=ngood
+        self['nbad']=nbad
+
+        expected=self['expected']
+        if expected is not None and ntot != expected:
+            raise ValueError("expected %s files, found %s" % (expected,ntot))
+
+    def get_check_files(self):
+        """
+        iterator over the check files
+        """
+        pattern=os.path.join(self['dir'], '*', '*', '*check*json')
+        return glob.iglob(pattern)
+
+    def _get_sigs(self):
+        """
+        get the list of check files and a dict holding the signature
+        of each
+        """
+        files=list(self.get_check_files())
+
+        pool=ThreadPool(NTHREADS)
+        try:
+            sigs=pool.map(file_sig, files, chunksize=100)
+        finally:
+            pool.close()
+            pool.join()
+
+        sigs=[json.dumps(sig) for sig in sigs]
+        return files, dict(zip(files,sigs))
+
+    def _get_changed(self, state, files, sigs):
+        """
+        get a dict keyed by the files that are new or changed since the
+        last pass, holding the signatures
+        """
+        if self['full']:
+            prev={}
+        else:
+            prev=state.get_sigs()
+
+        changed={}
+        for fname in files:
+            sig=sigs[fname]
+            if prev.get(fname) != sig:
+                changed[fname]=sig
+
+        return changed
+
+    def get_collated_urls(self):
+        """
+        the goodlist and badlist urls.  For ndjson the extension
+        is changed to .ndjson
+        """
+        df=self._df
+        goodfile=df.url(type='wlpipe_collated_goodlist', run=self['run'])
+        badfile=df.url(type='wlpipe_collated_badlist', run=self['run'])
+
+        if self['format']=='ndjson':
+            goodfile=goodfile.replace('.json','.ndjson')
+            badfile=badfile.replace('.json','.ndjson')
+
+        return goodfile, badfile
+
+    def _report(self, ngood, nbad, seconds):
+        ntot=ngood+nbad
+        if seconds > 0:
+            rate=ntot/seconds
+        else:
+            rate=0.0
+        print >>stderr,'%d files  %d bad  %.1f s  %.1f files/s' % \
+                (ntot,nbad,seconds,rate)
+
+class CollatedWriter(object):
+    """
+    Write json encoded results one at a time, either as elements of a json
+    list or one per line.  The data are written to a temporary file which is
+    moved into place on close, or removed if writing fails
+
+    parameters
+    ----------
+    path: string
+        The output path
+    format: string
+        'json' or 'ndjson'
+    """
+    def __init__(self, path, format):
+        self.path=path
+        self.format=format
+
+        self._tmp_path=path+'.tmp'
+        self._fobj=open(self._tmp_path,'w')
+        self._nwrite=0
+
+        if format=='json':
+            self._fobj.write('[\n')
+
+    def write(self, text):
+        """
+        write a json encoded result
+        """
+        if self.format=='json' and self._nwrite > 0:
+            self._fobj.write(',\n')
+
+        self._fobj.write(text)
+
+        if self.format=='ndjson':
+            self._fobj.write('\n')
+
+        self._nwrite+=1
+
+    def close(self):
+        """
+        finish the file and move it into place
+        """
+        try:
+            if self.format=='json':
+                self._fobj.write('\n]\n')
+            self._fobj.close()
+            os.rename(self._tmp_path, self.path)
+        except:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        close and remove the temporary file, leaving any existing
+        output in place
+        """
+        if not self._fobj.closed:
+            self._fobj.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def _reduce_one(fname):
+    """
+    read a check file, returning (fname, isgood, text, message) where text
+    is the compact json and message is printed for bad results
+    """
+    try:
+        with open(fname) as fobj:
+            d=json.load(fobj)
+    except (IOError,ValueError) as e:
+        d={'check_file':fname,
+           'error_string':'Error reading check file'}
+
+    if 'error_string' not in d:
+        d['error_string']='Error reading check file'
+
+    error_string=d['error_string']
+    isgood = (error_string == '')
+
+    if isgood:
+        message=None
+    else:
+        if 'output_files' not in d:
+            pv=fname
+        else:
+            pv=d['output_files'].get('status',fname)
+        message='%s\n%s' % (pv, error_string)
+
+    text=json.dumps(d, separators=(',',':'))
+    return fname, isgood, text, message
@@ -0,0 +1,63 @@
+"""
+A lazily made desdb connection shared within a process.
+
+Connecting to the DES database takes seconds, so the connection is made
+lazily, on the first query, and reused for the life of the process.
+
+Objects that keep a connection, such as the Generator or MultishearFiles,
+use the shared connection
+
+    conn=dbpool.get_shared()
+    cf=desdb.files.Coadd(coadd_run=coadd_run, band=band, conn=conn)
+
+Connections inherited through fork are not used by the child process; it
+makes its own.  The number of processes querying at once is limited by the
+callers, e.g. the semaphore of the desmeds ReleaseDriver.
+"""
+import os
+import threading
+
+class LazyConnection(object):
+    """
+    A desdb.Connection that connects on first use
+    """
+    def __init__(self):
+        self._conn=None
+        self._pid=os.getpid()
+        self._lock=threading.Lock()
+
+    def is_connected(self):
+        return self._conn is not None and self._pid == os.getpid()
+
+    def get(self):
+        """
+        get the underlying desdb.Connection, connecting if needed
+        """
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                import desdb
+                self._conn=desdb.Connection()
+                self._pid=os.getpid()
+            return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn=None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+_shared=None
+_shared_lock=threading.Lock()
+
+def get_shared():
+    """
+    the connection shared by all users in this process
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared=LazyConnection()
+        return _shared
@@ -1,5 +1,8 @@
 from . import genfiles
 from .genfiles import Generator
 
+from . import driver
+from .driver import ReleaseDriver
+
 from . import testbed
 from .testbed import testbeds
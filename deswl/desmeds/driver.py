@@ -0,0 +1,246 @@
+"""
+Generate the MEDS inputs and scripts for all tiles of a release.
+
+The coadd runs are distributed over a pool of processes, with all bands of a
+run done by the same worker so the information shared between bands is only
+fetched once.  Each worker holds its own Generator, and thus its own
+database connection.  The number of workers talking to the database at once
+is limited by a semaphore so the database is not overloaded.
+
+The outcome for each pair is written to a summary table
+
+    driver=ReleaseDriver(medsconf, nprocs=8)
+    summary=driver.go(coadd_runs, bands)
+    driver.write_summary(summary, 'meds013-summary.fits')
+"""
+from __future__ import print_function
+import os
+import time
+import traceback
+import multiprocessing
+
+import numpy
+import desdb
+
+from .. import files
+from .genfiles import Generator
+
+# maximum number of workers using the database at once
+DB_CONCURRENCY=4
+
+# maximum length of messages in the summary table
+MAX_MESSAGE=200
+
+class ReleaseDriver(object):
+    """
+    Write the MEDS inputs and scripts for many (coadd_run, band) pairs
+
+    parameters
+    ----------
+    medsconf: string
+        The meds config id, e.g. 013
+    nprocs: int, optional
+        Number of worker processes, default 1
+    db_concurrency: int, optional
+        Maximum number of workers using the database at once
+    check: bool, optional
+        Check that the inputs exist
+    version: string, optional
+        Code version for the scripts, default 'work'
+    clobber: bool, optional
+        Write even if the stats file exists
+    missing: bool, optional
+        Only write if the meds file does not exist
+    """
+    def __init__(self, medsconf, nprocs=1, db_concurrency=DB_CONCURRENCY,
+                 check=False, version='work', clobber=False, missing=False):
+        self.medsconf=medsconf
+        self.nprocs=nprocs
+        self.db_concurrency=db_concurrency
+        self.check=check
+        self.version=version
+        self.clobber=clobber
+        self.missing=missing
+
+        self.conf=files.read_meds_config(medsconf)
+
+    def go(self, coadd_runs, bands):
+        """
+        process all pairs, returning the summary table
+        """
+        tasks=[(coadd_run,bands) for coadd_run in coadd_runs]
+        ntot=len(coadd_runs)*len(bands)
+
+        print('processing %d coadd_run/band pairs with %d processes' % \
+                (ntot,self.nprocs))
+
+        init_args=(self.medsconf, self.check, self.version,
+                   self.clobber, self.missing)
+
+        tm0=time.time()
+        results=[]
+        if self.nprocs <= 1:
+            _init_worker(None, *init_args)
+            for task in tasks:
+                for res in _process_run(task):
+                    results.append(res)
+                    self._print_progress(results, ntot)
+        else:
+            semaphore=multiprocessing.BoundedSemaphore(self.db_concurrency)
+            pool=multiprocessing.Pool(self.nprocs,
+                                      initializer=_init_worker,
+                                      initargs=(semaphore,)+init_args)
+            try:
+                for run_results in pool.imap_unordered(_process_run, tasks):
+                    for res in run_results:
+                        results.append(res)
+                        self._print_progress(results, ntot)
+                pool.close()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        print('time: %.1f seconds' % (time.time()-tm0))
+        return make_summary(results)
+
+    def write_summary(self, summary, fname):
+        """
+        write the summary table
+        """
+        import fitsio
+
+        print('writing summary:',fname)
+        fitsio.write(fname, summary, clobber=True)
+
+    def _print_progress(self, results, ntot):
+        res=results[-1]
+        print('%d/%d: %s %s %s %s' % (len(results),ntot,
+                                      res['coadd_run'],res['band'],
+                                      res['status'],res['message']))
+
+def make_summary(results):
+    """
+    the per-pair results as a structured array, in the order of
+    coadd_run and band
+    """
+    results=sorted(results, key=lambda r: (r['coadd_run'],r['band']))
+
+    def maxlen(name):
+        return max([1]+[len(r[name]) for r in results])
+
+    dt=[('coadd_run','S%d' % maxlen('coadd_run')),
+        ('tilename','S%d' % maxlen('tilename')),
+        ('band','S%d' % maxlen('band')),
+        ('status','S7'),
+        ('nsource','i4'),
+        ('seconds','f4'),
+        ('message','S%d' % MAX_MESSAGE)]
+
+    summary=numpy.zeros(len(results), dtype=dt)
+    for i,r in enumerate(results):
+        for name,_ in dt:
+            summary[name][i] = r[name]
+
+    nfail=(summary['status'] == 'failed').sum()
+    nskip=(summary['status'] == 'skipped').sum()
+    print('%d written, %d skipped, %d failed' % \
+            (summary.size-nfail-nskip,nskip,nfail))
+    return summary
+
+def get_skip_reason(df, medsconf, coadd_run, band,
+                    clobber=False, missing=False):
+    """
+    the reason to skip a pair, or None
+    """
+    tilename=coadd_run.split('_')[1]
+
+    if missing:
+        meds_file=df.url(medsconf=medsconf,
+                         type='meds',
+                         coadd_run=coadd_run,
+                         tilename=tilename,
+                         band=band)
+        if os.path.exists(meds_file):
+            return "meds file already exists"
+
+    # because we might have a different "withbands" and "bands" we need
+    # to check the coadd cat is here
+    coadd_cat_file=df.url(type='coadd_cat',
+                          coadd_run=coadd_run,
+                          tilename=tilename,
+                          band=band)
+    if not os.path.exists(coadd_cat_file):
+        return "coadd does not exist for this band"
+
+    if not clobber:
+        stats_path=df.url(medsconf=medsconf,
+                          type='meds_stats',
+                          coadd_run=coadd_run,
+                          tilename=tilename,
+                          band=band)
+        if os.path.exists(stats_path):
+            return "stats file exists"
+
+    return None
+
+# state for each worker process
+_worker={}
+
+def _init_worker(semaphore, medsconf, check, version, clobber, missing):
+    """
+    make the generator for this process, which holds its own database
+    connection
+    """
+    _worker['gen']=Generator(medsconf,
+                             check=check,
+                             version=version,
+                             db_semaphore=semaphore)
+    _worker['df']=desdb.files.DESFiles()
+    _worker['medsconf']=medsconf
+    _worker['clobber']=clobber
+    _worker['missing']=missing
+
+def _process_run(task):
+    """
+    write the files for all bands of a coadd_run
+    """
+    coadd_run,bands=task
+    return [_process_pair( (coadd_run,band) ) for band in bands]
+
+def _process_pair(task):
+    """
+    write the files for a coadd_run and band, catching errors
+    """
+    coadd_run,band=task
+
+    res={'coadd_run':coadd_run,
+         'tilename':coadd_run.split('_')[1],
+         'band':band,
+         'status':'ok',
+         'nsource':0,
+         'seconds':0.0,
+         'message':''}
+
+    tm0=time.time()
+    try:
+        reason=get_skip_reason(_worker['df'], _worker['medsconf'],
+                               coadd_run, band,
+                               clobber=_worker['clobber'],
+                               missing=_worker['missing'])
+        if reason is not None:
+            res['status']='skipped'
+            res['message']=reason
+        else:
+            gen=_worker['gen']
+            gen.load_coadd(coadd_run, band)
+            gen.write_all()
+            res['nsource']=len(gen.srclist)
+    except Exception as err:
+        traceback.print_exc()
+        res['status']='failed'
+        res['message']=('%s: %s' % (err.__class__.__name__,err))[0:MAX_MESSAGE]
+
+    res['seconds']=time.time()-tm0
+    return res
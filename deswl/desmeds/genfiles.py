@@ -6,6 +6,8 @@ import desdb
 import fitsio
 
 from .. import files
+from .. import dbpool
+from .. import querycache
 
 
 _wq_template="""
@@ -173,11 +175,32 @@ def get_magzp_offset(conf):
     return offset
 
 class Generator(object):
-    def __init__(self, medsconf, check=False, version='work'):
+    """
+    parameters
+    ----------
+    medsconf: string
+        The meds config id
+    check: bool, optional
+        Check that the inputs exist
+    version: string, optional
+        Code version for the scripts, default 'work'
+    db_semaphore: semaphore, optional
+        Acquired while using the database, to limit the number of
+        processes querying at once
+    """
+    def __init__(self, medsconf, check=False, version='work',
+                 db_semaphore=None):
 
         self.medsconf=medsconf
         self.conf=files.read_meds_config(medsconf)
-        self.conn=desdb.Connection()
+        self.conn=dbpool.get_shared()
+
+        if db_semaphore is None:
+            db_semaphore=_NullSemaphore()
+        self.db_semaphore=db_semaphore
+
+        # coadd object info for the current coadd run, shared by all bands
+        self._coadd_object_cache={}
 
         self.check=check
         self.version=version
@@ -192,10 +215,11 @@ class Generator(object):
         self.coadd_run=coadd_run
         self.band=band
 
-        self.cf=desdb.files.Coadd(coadd_run=coadd_run,
-                                  band=band,
-                                  conn=self.conn)
-        self.cf.load(srclist=True)
+        with self.db_semaphore:
+            self.cf=querycache.load_coadd(coadd_run=coadd_run,
+                                          band=band,
+                                          srclist=True,
+                                          conn=self.conn)
 
         self.set_srclist()
 
@@ -244,25 +268,25 @@ class Generator(object):
 
         make_dirs(srclist_path)
 
-        print('writing:',srclist_path)
-        nmissing=0
-        with open(srclist_path,'w') as fobj:
-            for r in self.srclist:
+        if self.check:
+            nmissing=check_inputs(self.srclist)
+            print('nmissing: ',nmissing)
 
-                if self.check:
-                    nmissing += self.do_check_inputs(r)
+        # note the magzp offset is not applied to the written magzp
+        if self.include_wcs:
+            fmt='%d %d %s %s %s %s %s\n'
+            columns=['id','flags','red_image','red_bkg','red_seg',
+                     'magzp','wcs_file']
+        else:
+            fmt='%d %d %s %s %s %s\n'
+            columns=['id','flags','red_image','red_bkg','red_seg',
+                     'magzp']
 
-                magzp = r['magzp'] + self.magzp_offset
+        rows=zip( *[self.srclist[c].tolist() for c in columns] )
 
-                if self.include_wcs:
-                    line='%d %d %s %s %s %s %s\n'
-                    line = line % (r['id'],r['flags'],r['red_image'],r['red_bkg'],r['red_seg'],r['magzp'],r['wcs_file'])
-                else:
-                    line='%d %d %s %s %s %s\n'
-                    line = line % (r['id'],r['flags'],r['red_image'],r['red_bkg'],r['red_seg'],r['magzp'])
-                fobj.write(line)
-        if self.check:
-            print('nmissing: ',nmissing)
+        print('writing:',srclist_path)
+        with open(srclist_path,'w') as fobj:
+            fobj.write( ''.join(fmt % row for row in rows) )
 
     def write_wq(self):
         """
@@ -319,18 +343,20 @@ class Generator(object):
 
         coadd_info = self.get_coadd_object_info()
 
-        print("reading:",coadd_cat_file)
-        coadd_cat=fitsio.read(coadd_cat_file, lower=True)
+        if not coadd_info['verified']:
+            print("reading:",coadd_cat_file)
+            number=fitsio.read(coadd_cat_file, columns=['number'], lower=True)
 
-        print("verifying")
-        verify_coadd_ids(coadd_info, coadd_cat)
+            print("verifying")
+            verify_coadd_ids(coadd_info['data'], number)
+            coadd_info['verified']=True
 
         make_dirs(coadd_objects_id_file)
 
         print("writing:",coadd_objects_id_file)
-        with open(coadd_objects_id_file,'w') as fobj:
-            for i in xrange(coadd_info.size):
-                fobj.write("%s\n" % coadd_info['coadd_objects_id'][i])
+        numpy.savetxt(coadd_objects_id_file,
+                      coadd_info['data']['coadd_objects_id'],
+                      fmt='%d')
 
 
     def write_script(self):
@@ -446,6 +472,31 @@ class Generator(object):
 
 
     def get_coadd_object_info(self):
+        """
+        get the coadd object info for the coadd run.  The objects are the
+        same for all bands, so the result is kept for the other bands of the
+        same run.  A tile can have more than one coadd run, so the tilename
+        is not used as the key
+
+        returns
+        -------
+        A dict with 'data', the object_number and coadd_objects_id, and
+        'verified', whether data were checked against the catalog
+        """
+        coadd_run=self.coadd_run
+        coadd_info=self._coadd_object_cache.get(coadd_run,None)
+        if coadd_info is None:
+            data=self._query_coadd_object_info()
+            coadd_info={'data':data, 'verified':False}
+
+            self._coadd_object_cache.clear()
+            self._coadd_object_cache[coadd_run]=coadd_info
+        else:
+            print("using cached coadd_object_ids info for:",coadd_run)
+
+        return coadd_info
+
+    def _query_coadd_object_info(self):
         query="""
     select
         object_number, coadd_objects_id
@@ -460,7 +511,8 @@ class Generator(object):
 
         print("getting coadd_object_ids info for:",self.cf['image_id'])
         
-        res = self.conn.quick(query, array=True)
+        with self.db_semaphore:
+            res = self.conn.quick(query, array=True)
         return res
 
 
@@ -469,10 +521,7 @@ class Generator(object):
         set the srclist, checking possibly for redone astrometry.
         also check against blacklist
         """
-        srclist=self.cf.srclist
-
-        for s in srclist:
-            s['flags']=0
+        srclist=make_srclist_array(self.cf.srclist)
 
         add_bigind(srclist)
 
@@ -489,15 +538,15 @@ class Generator(object):
         self.srclist=srclist
 
 
-    def do_check_inputs(self, r):
-        nmissing=0
-        for ftype in ['red_image','red_bkg','red_seg']:
-            if not os.path.exists(r[ftype]):
-                print("missing %s %s %s: %s" % (r['run'],r['expname'],ftype,r[ftype]))
-                nmissing+=1
-
-        return nmissing
 
+class _NullSemaphore(object):
+    """
+    stands in for a semaphore when there is no limit
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
 
 def match_to_astro_rerun(srclist, conf, tilename):
     """
@@ -518,56 +567,166 @@ def match_to_astro_rerun(srclist, conf, tilename):
     out images with the higher flags, but I leave this up to you.  These are
     probably bad images anyway.  And many of them are at the boundary.
     """
-    import fitsio
     import esutil as eu
-    from esutil.numpy_util import ahelp
-    from pprint import pprint
 
     fname=conf['astro_rerun_file']
-    print("reading:",fname)
-    t=fitsio.read(fname,lower=True)
+    index=get_astro_rerun_index(fname,
+                                cache=conf.get('astro_rerun_cache',True))
 
     remove=2**0 + 2**1 + 2**2 + 2**3
 
-    #w,=numpy.where( (t['astrom_flag'] & remove) == 0 )
-    #if w.size == 0:
-    #    raise RuntimeError("no good entries")
-
-    #print("found %d/%d good entries" % (w.size, t.size))
-
-    #bigind = make_bigind(t['expnum'][w], t['ccdnum'][w])
-    bigind = make_bigind(t['expnum'], t['ccdnum'])
-
-    mdict={}
-    for i,ind in enumerate(bigind):
-        #mdict[ind] = t[w[i]]
-        mdict[ind] = t[i]
-
-    new_srclist=[]
-    for s in srclist:
-        sbigind=s['bigind']
-        mdata=mdict.get(sbigind,None)
-        if mdata is not None:
-            wcs_file=get_wcs_file(s)
-            flags=mdata['astrom_flag']
-            if (flags & remove) != 0:
-                print("skipping bad:",s['expname'],s['ccd'])
-            else:
-                s['flags'] |= flags
-                s['wcs_file'] = wcs_file
-                new_srclist.append(s)
-        else:
-            print("error: not found:",sbigind)
-            pprint(s)
-            print("continuing anyway")
-            #raise ValueError("image was not found!")
+    found,astrom_flags=index.get_flags(srclist['bigind'])
+
+    bad = found & ( (astrom_flags & remove) != 0 )
+    for i in numpy.where(bad)[0]:
+        print("skipping bad:",srclist['expname'][i],srclist['ccd'][i])
+
+    for i in numpy.where(~found)[0]:
+        print("error: not found:",srclist['bigind'][i])
+        print(srclist[i])
+        print("continuing anyway")
+
+    w,=numpy.where(found & ~bad)
+    new_srclist=srclist[w]
+    new_srclist['flags'] |= astrom_flags[w]
 
-            #pprint(s)
-            #ahelp(mdata)
+    wcs_files=[get_wcs_file(s) for s in new_srclist]
+    slen=max([1]+[len(f) for f in wcs_files])
+    new_srclist=eu.numpy_util.add_fields(new_srclist,
+                                         [('wcs_file','S%d' % slen)])
+    new_srclist['wcs_file']=wcs_files
 
-    print("kept %d/%d from srclist" % (len(new_srclist),len(srclist)))
+    print("kept %d/%d from srclist" % (new_srclist.size,srclist.size))
     return new_srclist
 
+# astrometry rerun indexes by file name, loaded once per process
+_astro_rerun_indexes={}
+
+def get_astro_rerun_index(fname, cache=True):
+    """
+    get the AstroRerunIndex for the astrometry rerun file, loading
+    it the first time only
+
+    parameters
+    ----------
+    fname: string
+        The astro_rerun_file
+    cache: bool, optional
+        Use an index cached on disk next to the file, writing it if
+        needed.  Default True
+    """
+    index=_astro_rerun_indexes.get(fname,None)
+    if index is None:
+        index=AstroRerunIndex(fname, cache=cache)
+        _astro_rerun_indexes[fname]=index
+    return index
+
+class AstroRerunIndex(object):
+    """
+    The astrom_flag from the astrometry rerun file, indexed by bigind
+
+    parameters
+    ----------
+    fname: string
+        The astro_rerun_file
+    cache: bool, optional
+        Use an index cached on disk as {fname}-index.npy, writing it
+        if needed.  Default True
+    """
+    def __init__(self, fname, cache=True):
+        self.fname=fname
+        self.cache_fname=get_astro_rerun_cache_url(fname)
+
+        if cache and self._cache_is_current():
+            print("reading:",self.cache_fname)
+            data=numpy.load(self.cache_fname)
+        else:
+            data=self._read()
+            if cache:
+                self._write_cache(data)
+
+        self.bigind=data['bigind']
+        self.astrom_flag=data['astrom_flag']
+
+    def get_flags(self, bigind):
+        """
+        get the astrom_flag for each input bigind
+
+        returns
+        -------
+        found, flags: bool array for the bigind that were found
+        and the astrom_flag, zero where not found
+        """
+        ind,found=lookup_sorted(self.bigind, bigind)
+
+        flags=numpy.zeros(found.size, dtype='i8')
+        flags[found] = self.astrom_flag[ind[found]]
+        return found, flags
+
+    def _read(self):
+        """
+        read the file and sort by bigind; for repeated bigind the
+        last entry is used
+        """
+        import fitsio
+
+        print("reading:",self.fname)
+        t=fitsio.read(self.fname, columns=['expnum','ccdnum','astrom_flag'],
+                      lower=True)
+
+        bigind = make_bigind(t['expnum'].astype('i8'),
+                             t['ccdnum'].astype('i8'))
+
+        ubigind,ind=numpy.unique(bigind[::-1], return_index=True)
+
+        data=numpy.zeros(ubigind.size, dtype=[('bigind','i8'),
+                                              ('astrom_flag','i8')])
+        data['bigind']=ubigind
+        data['astrom_flag']=t['astrom_flag'][::-1][ind]
+        return data
+
+    def _cache_is_current(self):
+        if not os.path.exists(self.cache_fname):
+            return False
+        return (os.path.getmtime(self.cache_fname)
+                >= os.path.getmtime(self.fname))
+
+    def _write_cache(self, data):
+        """
+        write the cache through a temporary file; failure to write
+        is not an error
+        """
+        tmp_fname='%s.tmp-%d' % (self.cache_fname, os.getpid())
+        try:
+            with open(tmp_fname,'wb') as fobj:
+                numpy.save(fobj, data)
+            os.rename(tmp_fname, self.cache_fname)
+            print("wrote:",self.cache_fname)
+        except (IOError,OSError) as err:
+            print("could not write cache %s: %s" % (self.cache_fname,err))
+
+def get_astro_rerun_cache_url(fname):
+    return fname+'-index.npy'
+
+def lookup_sorted(sorted_keys, keys):
+    """
+    find keys in a sorted, unique array
+
+    returns
+    -------
+    ind, found: The index into sorted_keys for each key, and a bool array
+    for the keys that were found.  ind is not meaningful where not found
+    """
+    keys=numpy.array(keys, dtype='i8', ndmin=1)
+    if sorted_keys.size == 0:
+        return (numpy.zeros(keys.size, dtype='i8'),
+                numpy.zeros(keys.size, dtype=bool))
+
+    ind=numpy.searchsorted(sorted_keys, keys)
+    ind.clip(0, sorted_keys.size-1, out=ind)
+    found = (sorted_keys[ind] == keys)
+    return ind, found
+
 
 def read_blacklist(fname):
     import esutil as eu
@@ -579,45 +738,70 @@ def read_blacklist(fname):
         data=fobj.read()
     return data
 
-def read_blacklist_as_dict(fname):
-    data=read_blacklist(fname)
+# blacklist name, file and flag.  Eli's flags go to 2**9
+_blacklist_files=[('ghost-sv',  'ghost-scatter-sv-uniq.txt', 2**10),
+                  ('ghost-y1',  'ghost-scatter-y1-uniq.txt', 2**11),
+                  ('noise-y1',  'noise-y1-uniq.txt',         2**12),
+                  ('streak-sv', 'streak-sv-uniq.txt',        2**13),
+                  ('streak-y1', 'streak-y1-uniq.txt',        2**14)]
 
-    bigind=make_bigind(data['expnum'], data['ccd'])
-    d={}
-    for i in xrange(data.size):
-        d[bigind[i]] = data[i]
+# the index is only built once per process
+_blacklist_index=None
 
-    return d
+def get_blacklist_index():
+    """
+    get the BlacklistIndex for all exposure blacklists, reading
+    the files the first time only
+    """
+    global _blacklist_index
 
-def get_exp_blacklists():
-    subdirs=['EXTRA','blacklists']
-    dir=desdb.files.get_dir_generic(subdirs)
+    if _blacklist_index is None:
+        subdirs=['EXTRA','blacklists']
+        dir=desdb.files.get_dir_generic(subdirs)
 
-    # Eli's flags go to 2**9
+        print("reading blackists")
+        bigind=[]
+        flags=[]
+        for name,fname,flag in _blacklist_files:
+            data=read_blacklist(os.path.join(dir, fname))
+            bigind.append( make_bigind(data['expnum'], data['ccd']) )
+            flags.append( numpy.zeros(data.size, dtype='i8') + flag )
 
-    print("reading blackists")
-    ldict={}
-    fname=os.path.join(dir, 'ghost-scatter-sv-uniq.txt')
-    ldict['ghost-sv'] = {'blacklist':read_blacklist_as_dict(fname),
-                         'flag': 2**10}
+        _blacklist_index=BlacklistIndex(numpy.concatenate(bigind),
+                                        numpy.concatenate(flags))
 
-    fname=os.path.join(dir, 'ghost-scatter-y1-uniq.txt')
-    ldict['ghost-y1'] = {'blacklist':read_blacklist_as_dict(fname),
-                         'flag': 2**11}
+    return _blacklist_index
 
-    fname=os.path.join(dir, 'noise-y1-uniq.txt')
-    ldict['noise-y1'] = {'blacklist':read_blacklist_as_dict(fname),
-                         'flag': 2**12}
+class BlacklistIndex(object):
+    """
+    Blacklist flags indexed by bigind, for vectorized lookups
+
+    parameters
+    ----------
+    bigind: array
+        The bigind of each blacklisted ccd; may be repeated
+    flags: array
+        The blacklist flag for each entry.  Flags for repeated bigind
+        are combined
+    """
+    def __init__(self, bigind, flags):
+        bigind=numpy.array(bigind, dtype='i8', ndmin=1)
+        flags=numpy.array(flags, dtype='i8', ndmin=1)
 
-    fname=os.path.join(dir, 'streak-sv-uniq.txt')
-    ldict['streak-sv'] = {'blacklist':read_blacklist_as_dict(fname),
-                         'flag': 2**13}
+        self.bigind,rev=numpy.unique(bigind, return_inverse=True)
+        self.flags=numpy.zeros(self.bigind.size, dtype='i8')
+        numpy.bitwise_or.at(self.flags, rev, flags)
 
-    fname=os.path.join(dir, 'streak-y1-uniq.txt')
-    ldict['streak-y1'] = {'blacklist':read_blacklist_as_dict(fname),
-                         'flag': 2**14}
+    def get_flags(self, bigind):
+        """
+        the blacklist flags for each input bigind, zero if not
+        blacklisted
+        """
+        ind,found=lookup_sorted(self.bigind, bigind)
 
-    return ldict
+        flags=numpy.zeros(found.size, dtype='i8')
+        flags[found] = self.flags[ind[found]]
+        return flags
 
 def get_wcs_file(sdict):
     subdirs=['EXTRA',
@@ -636,20 +820,72 @@ def add_blacklist_flags(srclist):
     """
     bigind and flags must be present already
     """
-    blacklists = get_exp_blacklists()
-    for s in srclist:
-        for bname,blist in blacklists.iteritems():
-            if s['bigind'] in blist['blacklist']:
-                print("    found in blacklist:",bname)
-                s['flags'] |= blist['flag']
+    if srclist.size == 0:
+        return
+
+    index = get_blacklist_index()
+
+    flags=index.get_flags(srclist['bigind'])
+    srclist['flags'] |= flags
 
+    for name,fname,flag in _blacklist_files:
+        nfound=( (flags & flag) != 0 ).sum()
+        if nfound > 0:
+            print("    found %d in blacklist: %s" % (nfound,name))
 
 def add_bigind(srclist):
-    for s in srclist:
-        expname=s['expname']
-        expnum=int( expname.split('_')[1] )
-        s['bigind'] = make_bigind(expnum, s['ccd'])
+    """
+    set the bigind column from the expname and ccd columns
+    """
+    if srclist.size == 0:
+        return
+
+    expnum=numpy.char.rpartition(srclist['expname'], '_')[:,2].astype('i8')
+    srclist['bigind'] = make_bigind(expnum, srclist['ccd'].astype('i8'))
+
+# columns kept from the Coadd srclist; strings are sized to fit
+_srclist_columns=[('id','i8'),
+                  ('run','S'),
+                  ('expname','S'),
+                  ('ccd','i4'),
+                  ('magzp','f8'),
+                  ('red_image','S'),
+                  ('red_bkg','S'),
+                  ('red_seg','S')]
+
+def make_srclist_array(srclist):
+    """
+    convert the list of dicts from a Coadd to a structured array, adding
+    zeroed flags and bigind columns
+    """
+    dt=[]
+    for name,type in _srclist_columns:
+        if type == 'S':
+            slen=max([1]+[len(s[name]) for s in srclist])
+            type='S%d' % slen
+        dt.append( (name,type) )
+    dt += [('flags','i8'),('bigind','i8')]
+
+    data=numpy.zeros(len(srclist), dtype=dt)
+    for name,type in _srclist_columns:
+        data[name] = [s[name] for s in srclist]
 
+    return data
+
+def check_inputs(srclist):
+    """
+    check the input files exist, returning the number missing
+    """
+    nmissing=0
+    for ftype in ['red_image','red_bkg','red_seg']:
+        for i,fname in enumerate(srclist[ftype]):
+            if not os.path.exists(fname):
+                print("missing %s %s %s: %s" % (srclist['run'][i],
+                                                srclist['expname'][i],
+                                                ftype,fname))
+                nmissing+=1
+
+    return nmissing
 
 def make_bigind(expnum, ccdnum):
     return expnum + ccdnum*10**7
@@ -657,10 +893,14 @@ def make_bigind(expnum, ccdnum):
 
 def verify_coadd_ids(coadd_info, coadd_cat):
 
+    if coadd_cat.size != coadd_info.size:
+        raise ValueError("catalog has %d objects but coadd_objects "
+                         "has %d" % (coadd_cat.size,coadd_info.size))
+
     w,=numpy.where(coadd_cat['number'] != coadd_info['object_number'])
     if w.size > 0:
         raise ValueError("number fields don't "
-                         "match %d/%d" % (w.size,cat.size))
+                         "match %d/%d" % (w.size,coadd_cat.size))
 
 
 def make_dirs(*args):
@@ -0,0 +1,307 @@
+"""
+Run a commands file on a single node, without MPI.
+
+This is an alternative to running the commands files under minions
+
+    deswl-exec -j 8 commands.txt
+
+Each line of the commands file is run with bash.  Each running command is
+supervised by a thread, which enforces the timeout by killing the process
+group.  Failed commands are retried with an exponential backoff.
+
+A status file holding the exit status is written for each command in the
+status directory, by default {commands_file}-status/{index}.status.
+
+Each finished command is appended to the journal {commands_file}.journal as
+a line of json with the hash of the command, exit status, duration and host.
+When the commands file is run again, commands already in the journal with
+exit status zero are skipped, so a job killed at the walltime can simply be
+resubmitted.  Send resume=False, or --no-resume on the command line, to run
+all commands.
+
+Commands files run under minions are not journaled.  To get the journal for
+PBS jobs, set pbs_exec in the runconfig; the single node minions scripts
+then run the commands file with deswl-exec.
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import signal
+import threading
+import subprocess
+import multiprocessing
+from sys import stderr
+from multiprocessing.pool import ThreadPool
+
+# exit status used for commands killed at the timeout, as from
+# the timeout program
+TIMEOUT_STATUS=124
+
+def read_commands(commands_file):
+    """
+    read the commands, skipping blank lines and comments
+    """
+    commands=[]
+    with open(commands_file) as fobj:
+        for line in fobj:
+            line=line.strip()
+            if line == '' or line[0] == '#':
+                continue
+            commands.append(line)
+    return commands
+
+def get_command_hash(command):
+    return hashlib.sha1(command).hexdigest()
+
+def read_journal(journal_file):
+    """
+    read the journal entries.  Incomplete lines, e.g. from a job that was
+    killed while writing, are skipped
+    """
+    entries=[]
+    if not os.path.exists(journal_file):
+        return entries
+
+    with open(journal_file) as fobj:
+        for line in fobj:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                pass
+
+    return entries
+
+def get_finished(journal_file):
+    """
+    count of successful completions for each command hash
+    """
+    finished={}
+    for entry in read_journal(journal_file):
+        if entry['exit_status'] == 0:
+            chash=entry['hash']
+            finished[chash] = finished.get(chash,0) + 1
+    return finished
+
+class Executor(dict):
+    """
+    Run the commands in a commands file using a pool of processes
+
+    parameters
+    ----------
+    commands_file: string
+        File with one command per line
+    nprocs: int, optional
+        Number of commands to run at once, default the number of cpus
+    timeout: float, optional
+        Seconds after which a command is killed, default no timeout
+    retries: int, optional
+        Number of times to retry a failed command, default 0
+    backoff: float, optional
+        Seconds to wait before the first retry.  This doubles for each
+        further retry.  Default 60
+    status_dir: string, optional
+        Directory for the status files, default {commands_file}-status
+    resume: bool, optional
+        Skip commands that already succeeded according to the
+        journal.  Default True
+    """
+    def __init__(self, commands_file, nprocs=None, timeout=None, retries=0,
+                 backoff=60.0, status_dir=None, resume=True):
+        if nprocs is None:
+            nprocs=multiprocessing.cpu_count()
+        if status_dir is None:
+            status_dir=commands_file+'-status'
+
+        self['commands_file']=commands_file
+        self['nprocs']=nprocs
+        self['timeout']=timeout
+        self['retries']=retries
+        self['backoff']=backoff
+        self['status_dir']=status_dir
+        self['resume']=resume
+        self['journal_file']=commands_file+'.journal'
+
+        self._lock=threading.Lock()
+        self._running={}
+        self._stopping=False
+
+    def go(self):
+        """
+        run all commands, returning the number that failed
+        """
+        commands=read_commands(self['commands_file'])
+        tasks=self._get_tasks(commands)
+        ncommands=len(tasks)
+
+        if not os.path.exists(self['status_dir']):
+            os.makedirs(self['status_dir'])
+
+        print >>stderr,'running %d commands with %d processes' % \
+                (ncommands,self['nprocs'])
+
+        tm0=time.time()
+        self._ndone=0
+        self._nfail=0
+        self._ncommands=ncommands
+        self._host=socket.gethostname()
+
+        self._journal_fobj=open(self['journal_file'],'a')
+        pool=ThreadPool(self['nprocs'])
+        try:
+            # map_async so the main thread can receive KeyboardInterrupt
+            res=pool.map_async(self._run_task, tasks, chunksize=1)
+            while not res.ready():
+                res.wait(1.0)
+            res.get()
+            pool.close()
+        except KeyboardInterrupt:
+            print >>stderr,'interrupted, killing running commands'
+            self._stopping=True
+            self._kill_all()
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self._journal_fobj.close()
+
+        seconds=time.time()-tm0
+        print >>stderr,'%d/%d commands failed' % (self._nfail,ncommands)
+        print >>stderr,'time: %.1f seconds' % seconds
+
+        return self._nfail
+
+    def _get_tasks(self, commands):
+        """
+        get the (index, command) to run, skipping those that already
+        succeeded if resuming
+        """
+        tasks=list(enumerate(commands))
+        if not self['resume']:
+            return tasks
+
+        finished=get_finished(self['journal_file'])
+        if len(finished) == 0:
+            return tasks
+
+        keep=[]
+        for index,command in tasks:
+            chash=get_command_hash(command)
+            if finished.get(chash,0) > 0:
+                # repeated commands are skipped as many times as
+                # they succeeded
+                finished[chash] -= 1
+            else:
+                keep.append( (index,command) )
+
+        print >>stderr,'skipping %d/%d commands finished according to ' \
+                'the journal' % (len(tasks)-len(keep),len(tasks))
+        return keep
+
+    def _run_task(self, task):
+        """
+        run a command with retries and record the result
+        """
+        index,command=task
+
+        attempt=0
+        tm0=time.time()
+        while True:
+            exit_status=self._run_command(index, command)
+            if exit_status == 0 or attempt >= self['retries'] or self._stopping:
+                break
+
+            wait=self['backoff']*2**attempt
+            print >>stderr,'command %d failed with status %d, retrying ' \
+                    'in %.1f seconds' % (index,exit_status,wait)
+            time.sleep(wait)
+            attempt += 1
+
+        seconds=time.time()-tm0
+
+        self._write_status(index, exit_status)
+        self._record(index, command, exit_status, attempt+1, seconds)
+
+    def _run_command(self, index, command):
+        """
+        run the command in its own process group, killing the group
+        if it runs past the timeout
+        """
+        proc=subprocess.Popen(command,
+                              shell=True,
+                              executable='/bin/bash',
+                              preexec_fn=os.setsid)
+
+        with self._lock:
+            self._running[index]=proc
+
+        timer=None
+        timed_out=[]
+        if self['timeout'] is not None:
+            def kill():
+                timed_out.append(True)
+                _kill_group(proc)
+            timer=threading.Timer(self['timeout'], kill)
+            timer.start()
+
+        try:
+            exit_status=proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self._lock:
+                del self._running[index]
+
+        if len(timed_out) > 0:
+            print >>stderr,'command %d timed out after %s seconds' % \
+                    (index,self['timeout'])
+            exit_status=TIMEOUT_STATUS
+        elif exit_status < 0:
+            # killed by a signal, report as the shell would
+            exit_status=128-exit_status
+
+        return exit_status
+
+    def _write_status(self, index, exit_status):
+        fname=os.path.join(self['status_dir'], '%06d.status' % index)
+        with open(fname,'w') as fobj:
+            fobj.write('%d\n' % exit_status)
+
+    def _record(self, index, command, exit_status, attempts, seconds):
+        """
+        append to the journal and report progress
+        """
+        entry={'hash':get_command_hash(command),
+               'index':index,
+               'exit_status':exit_status,
+               'attempts':attempts,
+               'seconds':round(seconds,3),
+               'host':self._host,
+               'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+        line=json.dumps(entry)
+
+        with self._lock:
+            self._journal_fobj.write(line+'\n')
+            self._journal_fobj.flush()
+
+            self._ndone += 1
+            if exit_status != 0:
+                self._nfail += 1
+
+            print >>stderr,'%d/%d done, %d failed, command %d: ' \
+                    'status %d in %.1f seconds' % \
+                    (self._ndone,self._ncommands,self._nfail,
+                     index,exit_status,seconds)
+
+    def _kill_all(self):
+        with self._lock:
+            procs=list(self._running.values())
+        for proc in procs:
+            _kill_group(proc)
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
@@ -850,53 +850,94 @@ def coadd_info_url(dataset, srclist=False):
     tdir=coadd_info_dir(dataset)
     return path_join(tdir, name)
 
-_coadd_info_cache={'dataset':None,
-                   'data':None,
-                   'url':None,
-                   'has_srclist':None}
+# number of dataset/srclist variants of the coadd info kept in memory
+COADD_INFO_CACHE_SIZE=4
+
+_coadd_info_cache=None
+
+def _get_coadd_info_cache():
+    global _coadd_info_cache
+    if _coadd_info_cache is None:
+        _coadd_info_cache=deswl.pathtemplates.LRUCache(COADD_INFO_CACHE_SIZE)
+    return _coadd_info_cache
+
+class CoaddInfo(object):
+    """
+    The coadd info for a dataset, keyed by id, with indexes by tilename
+    and by (tilename, band).  The data are not modified
+
+    parameters
+    ----------
+    dataset: string
+        The dataset
+    data: dict
+        The coadd info keyed by id
+    url: string
+        The file the data were read from
+    """
+    def __init__(self, dataset, data, url):
+        self.dataset=dataset
+        self.data=data
+        self.url=url
+
+        by_tile={}
+        by_tile_band={}
+        for key in sorted(data):
+            ci=data[key]
+            tile=ci['tilename']
+            by_tile.setdefault(tile, ci)
+            by_tile_band.setdefault( (tile,ci.get('band',None)), ci)
+
+        self.by_tile=by_tile
+        self.by_tile_band=by_tile_band
 
 def coadd_info_read(dataset, srclist=False, geturl=False):
+    cinfo=_coadd_info_read_indexed(dataset, srclist=srclist)
 
-    if (_coadd_info_cache['dataset'] == dataset 
-            and _coadd_info_cache['has_srclist']==srclist):
+    if geturl:
+        return cinfo.data, cinfo.url
+    else:
+        return cinfo.data
+
+def _coadd_info_read_indexed(dataset, srclist=False):
+    """
+    get the CoaddInfo, from the in-memory cache if possible
+    """
+    cache=_get_coadd_info_cache()
+    key=(dataset, srclist)
+
+    cinfo=cache.get(key)
+    if cinfo is not None:
         stdout.write('Re-using coadd info cache\n')
-        url=_coadd_info_cache['url']
-        data=_coadd_info_cache['data']
     else:
         url=coadd_info_url(dataset,srclist=srclist)
         print 'Reading coadd info:',url
         data=eu.io.read(url)
 
-        _coadd_info_cache['dataset'] = dataset
-        _coadd_info_cache['data'] = data
-        _coadd_info_cache['url'] = url
-        _coadd_info_cache['has_srclist'] = srclist
+        cinfo=CoaddInfo(dataset, data, url)
+        cache.set(key, cinfo)
 
-    if geturl:
-        return data, url
-    else:
-        return data
+    return cinfo
 
 def coadd_info_select(dataset, ids=None, tiles=None, bands=None, srclist=False):
     """
     Select from the input id or tile list.  Id and tile can be scalar
     or list/tupe.
-    
-    id is faster since that is they key, but keys by tile will be added as you
-    go.
 
+    If bands are sent with tiles, the first of the bands found for
+    each tile is used.
     """
 
     if ids is not None:
-        return coadd_info_select_ids(dataset, ds, srclist=srclist)
+        return coadd_info_select_ids(dataset, ids, srclist=srclist)
     elif tiles is not None:
-        return coadd_info_select_tile(dataset, tiles, bands=None, srclist=srclist)
+        return coadd_info_select_tile(dataset, tiles, bands=bands, srclist=srclist)
     else:
         raise ValueError("send either id= or tiles=")
 
 def coadd_info_select_ids(dataset, ids, srclist=False):
 
-    cinfo=coadd_info_read(dataset, srclist=srclist)
+    cinfo=_coadd_info_read_indexed(dataset, srclist=srclist)
     if isinstance(ids,(list,tuple)): 
         output=[]
         for id in ids:
@@ -909,54 +950,52 @@ def coadd_info_select_ids(dataset, ids, srclist=False):
 
 def _extract_coadd_info_id(cinfo, id):
     try:
-        ci = cinfo[id]
+        ci = cinfo.data[id]
     except KeyError:
         msg='id %s not found in coadd info for dataset %s'
-        msg=msg % (id,_coadd_info_cache['dataset'])
+        msg=msg % (id,cinfo.dataset)
         raise KeyError(msg)
 
     return ci
 
 def coadd_info_select_tile(dataset, tiles, bands=None, srclist=False):
 
-    cinfo=coadd_info_read(dataset, srclist=srclist)
+    cinfo=_coadd_info_read_indexed(dataset, srclist=srclist)
     if isinstance(tiles,(list,tuple)): 
         output=[]
         for tile in tiles:
-            ci=_extract_coadd_info_tile(cinfo, tile, bands=bands)
+            ci=_extract_coadd_info_tile_any(cinfo, tile, bands)
             output.append(ci)
     else:
-        output = _extract_coadd_info_tile(cinfo, tiles)
+        output = _extract_coadd_info_tile_any(cinfo, tiles, bands)
 
     return output
 
-def _extract_coadd_info_tile(cinfo, tile):
-    for key in cinfo:
-        ci=cinfo[key]
-        if ci['tilename'] == tile:
-            # also cache this tilename as key
-            cinfo[tile] = ci
-            return ci
+def _extract_coadd_info_tile_any(cinfo, tile, bands):
+    if bands is None:
+        return _extract_coadd_info_tile(cinfo, tile)
+    else:
+        return _extract_coadd_info_tile_band(cinfo, tile, bands)
 
-    msg='tile %s not found in coadd info for dataset %s'
-    msg=msg % (tile,_coadd_info_cache['dataset'])
-    raise ValueError(msg)
+def _extract_coadd_info_tile(cinfo, tile):
+    ci=cinfo.by_tile.get(tile,None)
+    if ci is None:
+        msg='tile %s not found in coadd info for dataset %s'
+        msg=msg % (tile,cinfo.dataset)
+        raise ValueError(msg)
+    return ci
 
 def _extract_coadd_info_tile_band(cinfo, tile, bands):
-    if not isinstance(bands,(type,list)):
+    if not isinstance(bands,(tuple,list)):
         bands=[bands]
 
-    for key in cinfo:
-        ci=cinfo[key]
-        for band in bands:
-            if ci['tilename'] == tile and ci['band'] == band:
-                # also cache this tilename-band as key
-                tk='%s-%s' % (tile,band)
-                cinfo[tk] = ci
-                return ci
-
-    msg='tile %s band %s not found in coadd info for dataset %s band %s'
-    msg=msg % (tile,band,_coadd_info_cache['dataset'])
+    for band in bands:
+        ci=cinfo.by_tile_band.get( (tile,band), None)
+        if ci is not None:
+            return ci
+
+    msg='tile %s bands %s not found in coadd info for dataset %s'
+    msg=msg % (tile,bands,cinfo.dataset)
     raise ValueError(msg)
 
 #
@@ -1046,13 +1085,38 @@ class MultishearFiles:
         self.rc=Runconfig(self.merun)
         self.fs=fs
         if conn is None:
-            import desdb
-            self.conn=desdb.Connection()
+            self.conn=deswl.dbpool.get_shared()
         else:
             self.conn=conn
 
 
     def get_flist(self):
+        """
+        Get the file sets for all coadds in the release.  The coadd info
+        for all tiles comes from a single query
+        """
+        if self.fs != desdb.files.get_default_fs():
+            # the release info has urls for the default file system
+            return self._get_flist_by_id()
+
+        print 'getting coadd info for release'
+        cinfo=deswl.querycache.get_coadd_info_by_release(self.rc['dataset'],
+                                                         self.rc['band'])
+        if len(cinfo) == 0:
+            raise ValueError("Found no coadds for release %s "
+                             "band %s" % (self.rc['dataset'],self.rc['band']))
+
+        print 'getting all the file sets'
+        all_fdicts=[]
+        for c in cinfo:
+            fdict=self._make_files(c)
+            all_fdicts.append(fdict)
+        return all_fdicts
+
+    def _get_flist_by_id(self):
+        """
+        get the file sets, loading each coadd separately
+        """
         query="""
         select
             id,tilename,band
@@ -1089,14 +1153,19 @@ class MultishearFiles:
         import desdb
 
         # first the coadd image and catalog
-        c=desdb.files.Coadd(id=id, 
-                            band=self.rc['band'], 
-                            dataset=self.rc['dataset'], 
-                            tilename=tilename, 
-                            fs=self.fs,
-                            conn=self.conn)
-        c.load()
-
+        c=deswl.querycache.load_coadd(id=id, 
+                                      band=self.rc['band'], 
+                                      dataset=self.rc['dataset'], 
+                                      tilename=tilename, 
+                                      fs=self.fs,
+                                      conn=self.conn)
+        return self._make_files(c)
+
+    def _make_files(self, c):
+        """
+        the file set for a coadd, which must have tilename, image_id,
+        image_url and cat_url
+        """
         # now get the output files
         outfiles=generate_me_output_urls(self.merun,
                                          c['tilename'], 
@@ -1151,34 +1220,89 @@ class MultishearSEInputs:
         self.fs=fs
 
         if conn is None:
-            import desdb
-            self.conn=desdb.Connection()
+            self.conn=deswl.dbpool.get_shared()
         else:
             self.conn=conn
 
 
     def generate_all_inputs(self):
         """
-        Generate all inputs for the input merun
+        Generate all inputs for the input merun.  The coadds and the single
+        epoch inputs of all coadds each come from one query, through the
+        query cache
         """
+        release=self.rc['dataset']
+        band=self.rc['band']
         query="""
         select
-            id
+            id, tilename
         from
             %(release)s_files
         where
             filetype='coadd'
-            and band='%(band)s'\n""" % {'release':self.rc['dataset'],
-                                       'band':self.rc['band']}
-        res=self.conn.quick(query)
-        if len(res) == 1:
+            and band='%(band)s'\n""" % {'release':release,
+                                       'band':band}
+
+        res=deswl.querycache.get_cache().cached('release_coadd_ids',
+                                                (release,band), {},
+                                                lambda: self.conn.quick(query))
+        if len(res) == 0:
             raise ValueError("Found no coadds for release %s "
-                             "band %s" % (self.rc['dataset'],self.rc['band']))
+                             "band %s" % (release,band))
 
+        if self.fs != desdb.files.get_default_fs():
+            # the red image urls are built for the default file system
+            for r in res:
+                self.generate_inputs(id=r['id'], tilename=r['tilename'])
+            return
+
+        srclists=self.get_release_srclists()
         for r in res:
-            id=r['id']
-            self.generate_inputs(id=id)
-       
+            self.write_inputs(r['tilename'], srclists.get(r['id'],[]))
+
+    def get_release_srclists(self):
+        """
+        get the single epoch inputs for all coadds in the release and band
+        with a single query, through the query cache
+
+        returns
+        -------
+        A dict keyed by coadd id of lists of dicts with url, run, expname
+        and ccd
+        """
+        release=self.rc['dataset']
+        band=self.rc['band']
+        query="""
+        select
+            coadd_src.coadd_imageid as coadd_id,
+            image.run,
+            image.exposurename as expname,
+            image.ccd
+        from
+            %(release)s_files, coadd_src, image
+        where
+            %(release)s_files.filetype='coadd'
+            and %(release)s_files.band='%(band)s'
+            and coadd_src.coadd_imageid = %(release)s_files.id
+            and coadd_src.src_imageid = image.id\n""" % {'release':release,
+                                                         'band':band}
+
+        print 'getting single epoch inputs for release'
+        res=deswl.querycache.get_cache().cached('release_coadd_srclists',
+                                                (release,band), {},
+                                                lambda: self.conn.quick(query))
+
+        df=desdb.files.DESFiles()
+        srclists={}
+        for r in res:
+            s={'run':r['run'],
+               'expname':r['expname'],
+               'ccd':r['ccd']}
+            s['url']=df.url('red_image', **s)
+            srclists.setdefault(r['coadd_id'],[]).append(s)
+
+        return srclists
+
     def generate_inputs(self, id=None, tilename=None):
         import desdb
         if tilename is None and id is None:
@@ -1188,9 +1312,14 @@ class MultishearSEInputs:
         elif tilename is None:
             tilename=self.get_tilename(id)
 
-        c=desdb.files.Coadd(id=id, conn=self.conn, fs=self.fs)
-        c.load(srclist=True)
+        c=deswl.querycache.load_coadd(id=id, conn=self.conn, fs=self.fs,
+                                      srclist=True)
+        self.write_inputs(tilename, c.srclist)
 
+    def write_inputs(self, tilename, srclist):
+        """
+        write the single epoch inputs for a tile
+        """
         url=self.get_url(tilename=tilename)
         url=os.path.expandvars(url)
         d=os.path.dirname(url)
@@ -1199,7 +1328,7 @@ class MultishearSEInputs:
 
         print 'writing me inputs:',url
         with open(url,'w') as fobj:
-            for s in c.srclist:
+            for s in srclist:
                 names=generate_se_filenames(self.rc['serun'],
                                             s['expname'],
                                             s['ccd'],
@@ -1676,7 +1805,7 @@ class ShearFiles(dict):
 
         self.conn=conn
         if self.conn is None:
-            self.conn=desdb.Connection()
+            self.conn=deswl.dbpool.get_shared()
 
         self.expnames = None
 
@@ -44,6 +44,8 @@ The collation step is not yet implemented; probably each owner of the code will
 have to do this step.
 """
 import os
+import stat
+import threading
 from sys import stderr
 from math import ceil
 import copy
@@ -53,6 +55,13 @@ import desdb
 
 MODFAC=1000
 
+# default number of threads for parallel file system operations
+NTHREADS=16
+
+# fixed per-object cost when chunking by cost, in the units of
+# ncutout*box_size**2
+COST_OFFSET=1000.0
+
 class GenericScripts(dict):
     """
     to create and write the metatadata files and scripts
@@ -85,6 +94,7 @@ class GenericScripts(dict):
         self.flists =None
 
         self._df=desdb.files.DESFiles()
+        self._paths=deswl.pathtemplates.PathTemplates(self._df)
 
         # time to check the outputs
         self.seconds_per_check=1.0
@@ -227,31 +237,30 @@ exit $exit_status
 
         commands=self.commands % allkeys
         allkeys['commands']=commands
-        allkeys['walltime_hours']=self.calc_walltime_job()
+        allkeys['walltime_hours']=self.calc_walltime_job(fdict=fdict)
 
         text = text % allkeys
         return text
 
 
-    def _extract_tilename(self,fdlist,tilename):
-        for fd in fdlist:
-            if fd['tilename'] == tilename:
-                return fd
-        raise ValueError("tilename not found: %d" % tilename)
+    def _extract_tilename(self,fdlist,tilename,index=None):
+        """
+        get the first job for the tile.  Send the index from
+        get_tile_index when extracting many tiles from the same list
+        """
+        if index is None:
+            index=get_tile_index(fdlist)
+        i=index.get(tilename,None)
+        if i is None:
+            raise ValueError("tilename not found: %s" % tilename)
+        return fdlist[i]
 
     def _write_master_script(self, fdict):
         path=self._df.url(type='wlpipe_master_script',run=self['run'])
 
         print >>stderr,path
-        eu.ostools.makedirs_fromfile(path)
-
-        with open(path,'w') as fobj:
-            text=self.get_master_script(fdict)
-            fobj.write(text)
-
-        cmd='chmod a+x %s' % path
-        print >>stderr,cmd
-        os.system(cmd)
+        text=self.get_master_script(fdict)
+        write_script(path, text, who='a')
 
     def _get_condor_template(self, master_script, overall_name):
         template="""Universe        = vanilla
@@ -282,7 +291,7 @@ requirements = (cpu_experiment == "star") || (cpu_experiment == "phenix")
         """
         # a dictionary keyed by tilename with all the entries for
         # that tile
-        fdd = eu.misc.collect_keyby(all_fd, 'tilename')
+        fdd = all_fd.collect_by_tile()
 
         master_script=self._df.url(type='wlpipe_master_script',run=self['run'])
 
@@ -314,9 +323,9 @@ requirements = (cpu_experiment == "star") || (cpu_experiment == "phenix")
                 checker_path=self._df.url(type='wlpipe_me_tile_checker',
                                           run=self['run'],
                                           tilename=tilename)
-                tdir=self._df.dir(type='wlpipe_tile',
-                                  run=self['run'],
-                                  tilename=tilename)
+                tdir=self._paths.dir(type='wlpipe_tile',
+                                    run=self['run'],
+                                    tilename=tilename)
                 if not os.path.exists(tdir):
                     print >>stderr,'making dir:',tdir
                     os.makedirs(tdir)
@@ -345,18 +354,10 @@ requirements = (cpu_experiment == "star") || (cpu_experiment == "phenix")
                         fd['output_files']['status']=status
 
                         if ifd==0:
-                            eu.ostools.makedirs_fromfile(log)
+                            makedirs_fromfile(log)
 
-                        if missing:
-                            ftypes=self.filetypes
-                            ok=True
-                            for ft in ftypes:
-                                path=fd['output_files'][ft]
-                                if not os.path.exists(path):
-                                    ok=False
-
-                            if ok:
-                                continue
+                        if missing and self._outputs_exist(fd):
+                            continue
 
                         text=self.get_master_command(fd)
 
@@ -394,11 +395,21 @@ Queue
 
 
 
-    def _write_me_command_list_by_tile(self, all_fd):
+    def _outputs_exist(self, fd):
+        """
+        True if all the output files for the job exist
+        """
+        for ft in self.filetypes:
+            path=fd['output_files'][ft]
+            if not os.path.exists(path):
+                return False
+        return True
+
+    def _write_me_command_list_by_tile(self, all_fd, missing=False):
 
         # a dictionary keyed by tilename with all the entries for
         # that tile
-        fdd = eu.misc.collect_keyby(all_fd, 'tilename')
+        fdd = all_fd.collect_by_tile()
 
         script_path=self._df.url(type='wlpipe_master_script',run=self['run'])
 
@@ -409,6 +420,7 @@ Queue
             if self.rc['detband'] != self.rc['band']:
                 # note these are the collated files
                 detrun_fd = self.get_flists(run=detrun, nper=None)
+                detrun_index = get_tile_index(detrun_fd)
                 have_detrun=True
 
         if all_fd[0]['start'] is not None:
@@ -432,6 +444,7 @@ Queue
                                       tilename=tilename)
             eu.ostools.makedirs_fromfile(commands_path)
             print >>stderr,commands_path
+            tile_jobs=[]
             with open(commands_path,'w') as fobj:
 
                 for ifd,fd in enumerate(fdlist):
@@ -449,27 +462,143 @@ Queue
 
                     if detrun_fd is not None:
                         # copy in collated files
-                        dfd = self._extract_tilename(detrun_fd,fd['tilename'])
+                        dfd = self._extract_tilename(detrun_fd,fd['tilename'],
+                                                     index=detrun_index)
                         for key,val in dfd['output_files'].iteritems():
                             new_key = '%s_detband' % (key,)
                             fd['input_files'][new_key] = val
 
                     if ifd==0:
-                        eu.ostools.makedirs_fromfile(log)
+                        makedirs_fromfile(log)
+
+                    if missing and self._outputs_exist(fd):
+                        continue
 
                     text=self.get_master_command(fd, have_detrun=have_detrun)
                     fobj.write(text)
                     fobj.write('\n')
+                    tile_jobs.append(fd)
                 
-            print >>stderr,minions_path
-            njobs=len(fdlist)
-            self.write_sub_minions(minions_path,commands_path,njobs)
+            njobs=len(tile_jobs)
+            if njobs > 0:
+                print >>stderr,minions_path
+                self.write_sub_minions(minions_path,commands_path,njobs,
+                                       flists=tile_jobs)
+            else:
+                os.remove(commands_path)
 
             if i==0 or ((i+1) % 10) == 0:
                 print >>stderr,"%d/%d" % (i+1,num)
             i+=1
 
 
+    def _write_me_command_list_binned(self, all_fd, missing=False):
+        """
+        Write the commands for all jobs packed into bins of roughly equal
+        predicted cost, with a commands file and a single node minions
+        script for each bin.  Jobs reading the same MEDS file are kept in
+        the same bin where possible, so the file is reused from the page
+        cache.
+
+        The number of bins is nbins from the runconfig, default nodes.
+        If missing=True, jobs with all outputs present are not packed
+        """
+        run=self['run']
+        nbins=self.rc.get('nbins', self.rc['nodes'])
+
+        script_path=self._df.url(type='wlpipe_master_script',run=run)
+
+        detrun=self.get_detrun()
+        detrun_fd = None
+        have_detrun=False
+        if detrun is not None:
+            if self.rc['detband'] != self.rc['band']:
+                # note these are the collated files
+                detrun_fd = self.get_flists(run=detrun, nper=None)
+                detrun_index = get_tile_index(detrun_fd)
+                have_detrun=True
+
+        jobs=[]
+        for fd in all_fd:
+            fd['script_path']=script_path
+            fd['run'] = run
+            self.set_job_files(fd)
+
+            if missing and self._outputs_exist(fd):
+                continue
+
+            if detrun_fd is not None:
+                # copy in collated files
+                dfd = self._extract_tilename(detrun_fd,fd['tilename'],
+                                             index=detrun_index)
+                for key,val in dfd['output_files'].iteritems():
+                    new_key = '%s_detband' % (key,)
+                    fd['input_files'][new_key] = val
+
+            jobs.append(fd)
+
+        if len(jobs) == 0:
+            print >>stderr,'no jobs to write'
+            return
+
+        costs=[self.get_job_cost(fd) for fd in jobs]
+        keys=[get_meds_key(fd) for fd in jobs]
+
+        print >>stderr,'packing',len(jobs),'jobs into',nbins,'bins'
+        bins,loads=deswl.binpack.pack(costs, keys, nbins)
+        print >>stderr,'    max bin load: %.1f hours' % (max(loads)/3600.,)
+        print >>stderr,'    efficiency: %.3f' % deswl.binpack.get_efficiency(loads)
+
+        ppn=self.rc['ppn']
+        bins_dir=self.get_bins_dir()
+        for ibin,ind in enumerate(bins):
+            if len(ind) == 0:
+                continue
+
+            front='%s-bin%03d' % (run,ibin)
+            commands_path=os.path.join(bins_dir, front+'-commands.txt')
+            minions_path=os.path.join(bins_dir, front+'-minions.pbs')
+
+            eu.ostools.makedirs_fromfile(commands_path)
+            print >>stderr,commands_path
+
+            bin_jobs=[jobs[i] for i in ind]
+            with open(commands_path,'w') as fobj:
+                for fd in bin_jobs:
+                    makedirs_fromfile(fd['output_files']['log'])
+
+                    text=self.get_master_command(fd, have_detrun=have_detrun)
+                    fobj.write(text)
+                    fobj.write('\n')
+
+            walltime=self.calc_bin_walltime(ppn, [costs[i] for i in ind])
+            self.write_sub_minions(minions_path, commands_path, len(bin_jobs),
+                                   flists=bin_jobs, nodes=1,
+                                   walltime=walltime,
+                                   job_name=front)
+
+    def get_bins_dir(self):
+        """
+        directory for the binned command lists and minions scripts
+        """
+        d=self._paths.dir(type='wlpipe_run', run=self['run'])
+        return os.path.join(d, 'bins')
+
+    def get_job_cost(self, fd):
+        """
+        The predicted seconds for the job.  Without a timing model
+        seconds_per is scaled by the number of objects relative to nper
+        """
+        if self.get_timing_model() is not None:
+            return self.predict_job_seconds(fd)
+
+        nobj=fd.get('nobj',None)
+        nper=fd.get('nper',None)
+        if nobj and nper:
+            return self.seconds_per*nobj/float(nper)
+
+        return self.seconds_per
+
     def write_by_tile_master(self, tilename=None, missing=False):
         """
         Instead of writing scripts for each job, write out
@@ -484,6 +613,8 @@ Queue
         ppn=self.rc.get('ppn',None)
         if ppn is None:
             self._write_condor_me(all_fd, missing=missing)
+        elif self.rc.get('bin_pack',False):
+            self._write_me_command_list_binned(all_fd, missing=missing)
         else:
             self._write_me_command_list_by_tile(all_fd, missing=missing)
 
@@ -504,6 +635,7 @@ Queue
             if self.rc['detband'] != self.rc['band']:
                 # note these are the collated files
                 detrun_fd = self.get_flists(run=detrun, nper=None, tilename=tilename)
+                detrun_index = get_tile_index(detrun_fd)
 
         if all_fd[0]['start'] is not None:
             dosplit=True
@@ -520,31 +652,34 @@ Queue
         modnum=ne/MODFAC
         if modnum <= 0:
             modnum=1
+
+        writer=ScriptWriter(nthreads=self.get('nthreads',NTHREADS))
+        manifest=self._open_manifest()
         for i,fd in enumerate(all_fd):
 
             fd['run'] = self['run']
-
-            # start/end are for 
-            script,status,meta,log=self._extract_tile_files(fd)
-
-            fd['script'] = script
-            fd['output_files']['log']=log
-            fd['output_files']['meta']=meta
-            fd['output_files']['status']=status
+            self.set_job_files(fd)
 
             if detrun_fd is not None:
                 # copy in collated files
-                dfd = self._extract_tilename(detrun_fd,fd['tilename'])
+                dfd = self._extract_tilename(detrun_fd,fd['tilename'],
+                                             index=detrun_index)
                 for key,val in dfd['output_files'].iteritems():
                     new_key = '%s_detband' % (key,)
                     fd['input_files'][new_key] = val
 
             if i==0 or (i % modnum) == 0:
                 print >>stderr,"%d/%d" % (i+1,ne)
-                print >>stderr,"    %s" % meta
+                print >>stderr,"    %s" % fd['output_files']['meta']
                 print >>stderr,"    %s" % fd['script']
 
-            self._write_meta_and_script_single(fd)
+            self._write_meta_and_script_single(fd,
+                                               writer=writer,
+                                               manifest=manifest)
+
+        writer.close()
+        if manifest is not None:
+            manifest.close()
 
     def _extract_tile_files(self, fd):
         #import pprint
@@ -559,44 +694,101 @@ Queue
             end=None
 
         band=fd['band']
-        df=self._df
-        script=df.url('wlpipe_me_script'+extra,
+        paths=self._paths
+        script=paths.url('wlpipe_me_script'+extra,
+                         run=run,
+                         tilename=tilename,
+                         band=band,
+                         start=start,
+                         end=end)
+
+        status=paths.url('wlpipe_me_status'+extra,
+                         run=run,
+                         tilename=tilename,
+                         band=band,
+                         start=start,
+                         end=end)
+
+        meta=paths.url('wlpipe_me_meta'+extra,
+                       run=run,
+                       tilename=tilename,
+                       band=band,
+                       start=start,
+                       end=end)
+        log=paths.url('wlpipe_me_log'+extra,
                       run=run,
                       tilename=tilename,
                       band=band,
                       start=start,
                       end=end)
+        return script, status, meta, log
 
-        status=df.url('wlpipe_me_status'+extra,
+    def _extract_ccd_files(self, fd):
+        run=fd['run']
+        expname=fd['expname']
+        ccd=fd['ccd']
+
+        paths=self._paths
+        script=paths.url('wlpipe_se_script',
+                         run=run,
+                         expname=expname,
+                         ccd=ccd)
+        status=paths.url('wlpipe_se_status',
+                         run=run,
+                         expname=expname,
+                         ccd=ccd)
+        meta=paths.url('wlpipe_se_meta',
+                       run=run,
+                       expname=expname,
+                       ccd=ccd)
+        log=paths.url('wlpipe_se_log',
                       run=run,
-                      tilename=tilename,
-                      band=band,
-                      start=start,
-                      end=end)
-
-        meta=df.url('wlpipe_me_meta'+extra,
-                    run=run,
-                    tilename=tilename,
-                    band=band,
-                    start=start,
-                    end=end)
-        log=df.url('wlpipe_me_log'+extra,
-                   run=run,
-                   tilename=tilename,
-                   band=band,
-                   start=start,
-                   end=end)
+                      expname=expname,
+                      ccd=ccd)
         return script, status, meta, log
 
+    def set_job_files(self, fd):
+        """
+        Set the script and the log, meta and status outputs for the job,
+        by tile/band or expname/ccd
+
+        parameters
+        ----------
+        fd: dict
+            The job dict from get_flists.  Modified in place.
+        """
+        if 'tilename' in fd:
+            script,status,meta,log=self._extract_tile_files(fd)
+        else:
+            script,status,meta,log=self._extract_ccd_files(fd)
+
+        fd['script'] = script
+        fd['output_files']['log']=log
+        fd['output_files']['meta']=meta
+        fd['output_files']['status']=status
+
     def get_flists_by_tile(self, run=None, nper=None, tilename=None):
         """
         For each tile and band, get the input and outputs
-        files and some other data.  Return as a list of dicts
+        files and some other data.  Return as an MEJobList, which
+        acts as a list of dicts
 
         If run is not sent, then the rc of the current run
         and nper are used.  If run is sent, that runconfig
         will be loaded and nper will be taken from the keyword.
 
+        The full list is cached on disk under the wlpipe_flists directory,
+        keyed by the run, releases, bands, withbands, medsconf and nper.  A
+        fingerprint of the runconfig, the output settings and the release
+        coadd info is stored with the cache, and the list is regenerated if
+        it does not match.  The coadd info comes from the query cache, so
+        after a release changes
+
+            deswl.querycache.invalidate('get_coadd_info_by_release')
+
+        refreshes both.  Send use_flists_cache=False to the constructor to
+        skip the cache.
+
         The sub-modules will create a get_flists() function
         that calls this
         """
@@ -610,8 +802,124 @@ Queue
         else:
             rc = deswl.files.Runconfig(run)
 
+        use_cache=self.get('use_flists_cache',True)
+
+        cache_key=self._get_flists_cache_key(run, rc, nper)
+        path=self._get_flists_cache_path(cache_key)
+
+        flists=None
+        coadd_info=None
+        if use_cache:
+            coadd_info=self._get_release_coadd_info(rc)
+            release_marker=get_release_marker(coadd_info)
+            fingerprint=self._get_flists_fingerprint(cache_key, rc,
+                                                     release_marker)
+            flists=self._read_flists_cache(path, fingerprint)
+
+        if flists is None:
+            # only generate the requested tile if we can't use a full
+            # list from the cache; partial lists are not cached
+            flists=self._generate_flists_by_tile(run, rc, nper,
+                                                 tilename=tilename,
+                                                 coadd_info=coadd_info)
+            if use_cache and tilename is None:
+                self._write_flists_cache(path, fingerprint, flists)
+
+        if tilename is not None:
+            flists = flists.select_tile(tilename)
+
+        self.flists = flists
+        return flists
+
+    def _generate_flists_by_tile(self, run, rc, nper, tilename=None,
+                                 coadd_info=None):
+        """
+        query the database and generate the MEJobList.  There is one shared
+        record per tile and a row in the chunk table for each job.  Send
+        the release coadd_info if it was already read
+        """
         df=desdb.files.DESFiles()
 
+        band=rc['band']
+        band_is_list=isinstance(band,list)
+
+        if coadd_info is None:
+            coadd_info=self._get_release_coadd_info(rc)
+        flists0 = coadd_info
+
+
+        if tilename is not None:
+            tfd=flists0
+            flists0 = [fd for fd in tfd if fd['tilename']==tilename]
+
+        medsconf=rc['medsconf']
+
+        chunk_by_cost=self.rc.get('chunk_by_cost',False)
+        if nper and not chunk_by_cost:
+            # probe all the row counts at once rather than opening
+            # the catalogs serially
+            cat_files=[fd0['cat_url'] for fd0 in flists0]
+            self._load_nrows_index(cat_files)
+
+        tiles=[]
+        for fd0 in flists0:
+
+            tilename=fd0['tilename']
+
+            fd0['run'] = run
+            fd0['medsconf']=medsconf
+            fd0['timeout'] = self.timeout
+
+            if band_is_list:
+                meds_files=[]
+
+                input_files={}
+                for b in band:
+                    n='meds_'+b
+                    meds_file=df.url('meds',
+                                     coadd_run=fd0['coadd_run'],
+                                     medsconf=fd0['medsconf'],
+                                     tilename=tilename,
+                                     band=b)
+
+                    input_files[n] = meds_file
+                    meds_files.append(meds_file)
+                fd0['meds'] = ','.join(meds_files)
+ 
+            else:
+                meds_file=df.url('meds',
+                                 coadd_run=fd0['coadd_run'],
+                                 medsconf=fd0['medsconf'],
+                                 tilename=tilename,
+                                 band=band)
+                input_files={'meds':meds_file}
+            fd0['input_files'] = input_files
+            if nper:
+                fd0['nper']=nper
+
+            tiles.append(fd0)
+
+        if nper:
+            all_chunks=self._get_all_me_chunks(tiles)
+        else:
+            # a single job for the whole tile
+            all_chunks=[([-1],[-1])]*len(tiles)
+
+        itile_list=[]
+        start_list=[]
+        end_list=[]
+        for itile,(startlist,endlist) in enumerate(all_chunks):
+            itile_list += [itile]*len(startlist)
+            start_list += startlist
+            end_list += endlist
+
+        chunks=make_chunk_table(itile_list, start_list, end_list)
+        return MEJobList(self, run, tiles, chunks)
+
+    def _get_release_coadd_info(self, rc):
+        """
+        the coadd info for the release, through the query cache
+        """
         band=rc['band']
         withbands=rc.get('withbands', band)
 
@@ -619,94 +927,118 @@ Queue
         print 'getting coadd info by release'
         print 'releases:',release
         if isinstance(band,list):
-            band_is_list=True
             useband='i'
         else:
-            band_is_list=False
             useband=band
 
+        return deswl.querycache.get_coadd_info_by_release(release,
+                                                          useband,
+                                                          withbands=withbands)
 
-        d=self._df.dir(type='wlpipe_flists', run=self['run'])
-        if isinstance(release,list):
-            rstr='-'.join(release)
-        else:
-            rstr=release
-        fname='%s-coadd-info-%s-%s' % (self['run'],rstr, useband)
-        bstr='-'.join(band)
-        fname='%s-%s' % (fname, bstr)
-
-        fname=fname+'.json'
-        path=os.path.join(d, fname)
-
-        #if not os.path.exists(path):
-        if True:
-            #print 'cache not found, generating coadd info list'
+    def _get_flists_cache_key(self, run, rc, nper):
+        """
+        the things that determine the content of the tile flists
+        """
+        band=rc['band']
+        key={'run':run,
+             'dataset':rc['dataset'],
+             'band':band,
+             'withbands':rc.get('withbands',band),
+             'medsconf':rc['medsconf'],
+             'nper':nper}
+        return key
+
+    def _get_flists_fingerprint(self, cache_key, rc, release_marker):
+        """
+        hash of the cache key, the full runconfig, the output
+        settings of this class and the release marker.  If any of
+        these change the cache is stale
+        """
+        import json
+        import hashlib
 
-            flists0 = desdb.files.get_coadd_info_by_release(release,
-                                                            useband,
-                                                            withbands=withbands)
+        data={'key':cache_key,
+              'release':release_marker,
+              'format':'chunk-table',
+              'runconfig':dict(rc),
+              'class':self.__class__.__name__,
+              'filetypes':self.filetypes,
+              'timeout':self.timeout}
 
+        text=json.dumps(data, sort_keys=True)
+        return hashlib.md5(text).hexdigest()
 
-            if tilename is not None:
-                tfd=flists0
-                flists0 = [fd for fd in tfd if fd['tilename']==tilename]
+    def _get_flists_cache_path(self, cache_key):
+        """
+        the name encodes the key in a readable way, with a short hash
+        so different nper etc. get different files
+        """
+        import json
+        import hashlib
 
-            medsconf=rc['medsconf']
+        release=cache_key['dataset']
+        if isinstance(release,list):
+            rstr='-'.join(release)
+        else:
+            rstr=release
 
-            flists=[]
-            for fd0 in flists0:
+        band=cache_key['band']
+        if isinstance(band,list):
+            bstr=''.join(band)
+        else:
+            bstr=band
 
-                tilename=fd0['tilename']
+        text=json.dumps(cache_key, sort_keys=True)
+        khash=hashlib.md5(text).hexdigest()[0:8]
 
-                fd0['run'] = run
-                fd0['medsconf']=medsconf
-                fd0['timeout'] = self.timeout
+        d=self._paths.dir(type='wlpipe_flists', run=self['run'])
+        fname='%s-flists-%s-%s-%s.json' % (cache_key['run'],rstr,bstr,khash)
+        return os.path.join(d, fname)
 
-                if band_is_list:
-                    meds_files=[]
+    def _read_flists_cache(self, path, fingerprint):
+        """
+        read the cache, returning None if it is missing or stale
+        """
+        if not os.path.exists(path):
+            print 'flists cache not found:',path
+            return None
 
-                    input_files={}
-                    for b in band:
-                        n='meds_'+b
-                        meds_file=df.url('meds',
-                                         coadd_run=fd0['coadd_run'],
-                                         medsconf=fd0['medsconf'],
-                                         tilename=tilename,
-                                         band=b)
+        print 'reading flists cache:',path
+        try:
+            data=eu.io.read(path)
+        except ValueError:
+            print >>stderr,'could not read flists cache, regenerating'
+            return None
+
+        if data.get('fingerprint',None) != fingerprint:
+            print 'flists cache is stale, regenerating'
+            return None
+
+        flists=data['flists']
+        chunks=make_chunk_table(flists['itile'],
+                                flists['start'],
+                                flists['end'])
+        return MEJobList(self, flists['run'], flists['tiles'], chunks)
+
+    def _write_flists_cache(self, path, fingerprint, flists):
+        """
+        write to a temporary file and move into place so a
+        partially written cache is never read
+        """
+        print 'writing flists cache:',path
+        eu.ostools.makedirs_fromfile(path)
 
-                        input_files[n] = meds_file
-                        meds_files.append(meds_file)
-                    fd0['meds'] = ','.join(meds_files)
-     
-                else:
-                    meds_file=df.url('meds',
-                                     coadd_run=fd0['coadd_run'],
-                                     medsconf=fd0['medsconf'],
-                                     tilename=tilename,
-                                     band=band)
-                    input_files={'meds':meds_file}
-                fd0['input_files'] = input_files
-
-                if nper:
-                    fd0['nper']=nper
-                    fd_bychunk=self._set_me_outputs_by_chunk(run, fd0, self.filetypes)
-                    flists += fd_bychunk
-                else:
-                    # copies into fd0
-                    self._set_me_outputs(run, fd0, self.filetypes)
-                    fd0['start']=None
-                    fd0['end']=None
-                    fd0['nobj']=None
-                    flists.append(fd0)
-
-            #print 'writing cache:',path
-            #eu.io.write(path, flists)
-        else:
-            print 'reading cache:',path
-            flists=eu.io.read(path)
+        chunks=flists.chunks
+        data={'fingerprint':fingerprint,
+              'flists':{'run':flists.run,
+                        'tiles':flists.tiles,
+                        'itile':chunks['itile'].tolist(),
+                        'start':chunks['start'].tolist(),
+                        'end':chunks['end'].tolist()}}
 
-        self.flists = flists
-        return flists
+        tmp_path='%s.tmp-%d' % (path, os.getpid())
+        eu.io.write(tmp_path, data, type='json', clobber=True)
+        os.rename(tmp_path, path)
 
     def _set_me_outputs(self, run, fd, filetypes, start=None, end=None):
         tilename=fd['tilename']
@@ -720,24 +1052,63 @@ Queue
                                                end=end)
 
 
-    def _set_me_outputs_by_chunk(self, run, fd0, filetypes):
+    def _get_all_me_chunks(self, tiles):
+        """
+        get the chunks for each tile.  When chunking by cost the MEDS
+        files are read using a pool of threads
+        """
+        if not self.rc.get('chunk_by_cost',False):
+            return [self._get_me_chunks(fd0) for fd0 in tiles]
+
+        from multiprocessing.pool import ThreadPool
+
+        nthreads=self.get('nthreads',NTHREADS)
+        print 'getting chunks by cost for',len(tiles),'tiles with', \
+                nthreads,'threads'
+
+        pool=ThreadPool(nthreads)
+        try:
+            all_chunks=pool.map(self._get_me_chunks, tiles)
+        finally:
+            pool.close()
+            pool.join()
+
+        return all_chunks
+
+    def _get_me_chunks(self, fd0):
+        """
+        get the start and end of each chunk for the tile.  If chunk_by_cost
+        is set in the runconfig the chunks have roughly equal predicted
+        cost, otherwise equal numbers of objects
+        """
         nper=fd0['nper']
-        nrows=self._get_nrows(fd0['cat_url'])
-        startlist,endlist=get_chunks(nrows, nper)
+        if self.rc.get('chunk_by_cost',False):
+            cost=self._get_me_object_cost(fd0)
+            return get_chunks_by_cost(cost, nper)
 
-        flists=[]
-        for start,end in zip(startlist,endlist):
-            fd=copy.deepcopy(fd0)
+        nrows=self._get_nrows(fd0['cat_url'])
+        return get_chunks(nrows, nper)
 
-            self._set_me_outputs(run, fd, filetypes, start=start, end=end)
+    def _get_me_object_cost(self, fd0):
+        """
+        predicted cost for each object in the tile, summed over the
+        MEDS files for all bands
+        """
+        offset=self.rc.get('chunk_cost_offset',COST_OFFSET)
 
-            fd['start'] = start
-            fd['end'] = end
-            fd['nobj'] = end-start+1
+        cost=None
+        for ftype in sorted(fd0['input_files']):
+            if not ftype.startswith('meds'):
+                continue
 
-            flists.append( fd )
+            meds_file=fd0['input_files'][ftype]
+            tcost=read_object_cost(meds_file, offset=offset)
+            if cost is None:
+                cost=tcost
+            else:
+                cost += tcost
 
-        return flists
+        return cost
 
 
     def get_me_outputs(self, filetypes, **keys):
@@ -777,14 +1148,14 @@ Queue
         fdict={}
         for ftype in filetypes:
             ext=filetypes[ftype]['ext']
-            fdict[ftype] = self._df.url(type=type,
-                                        run=run,
-                                        tilename=tilename,
-                                        band=band,
-                                        filetype=ftype,
-                                        ext=ext,
-                                        start=start,
-                                        end=end)
+            fdict[ftype] = self._paths.url(type=type,
+                                           run=run,
+                                           tilename=tilename,
+                                           band=band,
+                                           filetype=ftype,
+                                           ext=ext,
+                                           start=start,
+                                           end=end)
         return fdict
 
     def write_by_ccd_master(self):
@@ -804,7 +1175,8 @@ Queue
         # also makes directory
         minions_path=df.url(type='wlpipe_minions', run=self['run'])
         commands_path=df.url(type='wlpipe_commands', run=self['run'])
-        self.write_sub_minions(minions_path,commands_path,num)
+        self.write_sub_minions(minions_path,commands_path,num,
+                               flists=all_fd)
 
         self._write_se_command_list_by_ccd(all_fd)
 
@@ -839,7 +1211,7 @@ Queue
                                 run=run,
                                 expname=expname,
                                 ccd=ccd)
-                eu.ostools.makedirs_fromfile(log_file)
+                makedirs_fromfile(log_file)
 
                 fd['output_files']['log']=log_file
 
@@ -860,47 +1232,30 @@ Queue
         Write all scripts by expname/ccd
         """
 
-        df=self._df
-
         all_fd = self.get_flists()
         i=1
         ne=len(all_fd)
         modnum=ne/MODFAC
+        if modnum <= 0:
+            modnum=1
+
+        writer=ScriptWriter(nthreads=self.get('nthreads',NTHREADS))
+        manifest=self._open_manifest()
         for i,fd in enumerate(all_fd):
-            run=fd['run']
-            expname=fd['expname']
-            ccd=fd['ccd']
-
-            script_file=df.url('wlpipe_se_script',
-                               run=run,
-                               expname=expname,
-                               ccd=ccd)
-
-            status_file=df.url('wlpipe_se_status',
-                               run=run,
-                               expname=expname,
-                               ccd=ccd)
-
-            meta_file=df.url('wlpipe_se_meta',
-                             run=run,
-                             expname=expname,
-                             ccd=ccd)
-            log_file=df.url('wlpipe_se_log',
-                            run=run,
-                            expname=expname,
-                            ccd=ccd)
-
-            fd['script'] = script_file
-            fd['output_files']['log']=log_file
-            fd['output_files']['meta']=meta_file
-            fd['output_files']['status']=status_file
+            self.set_job_files(fd)
 
             if i==0 or (i % modnum) == 0:
                 print >>stderr,"%d/%d" % (i,ne)
-                print >>stderr,"    %s" % meta_file
+                print >>stderr,"    %s" % fd['output_files']['meta']
                 print >>stderr,"    %s" % fd['script']
 
-            self._write_meta_and_script_single(fd)
+            self._write_meta_and_script_single(fd,
+                                               writer=writer,
+                                               manifest=manifest)
+
+        writer.close()
+        if manifest is not None:
+            manifest.close()
 
     def get_flists_by_ccd(self, **keys):
         """
@@ -914,57 +1269,117 @@ Queue
         if self.flists is not None:
             return self.flists
 
-        flists = self.cache_flists_by_ccd()
-        for fd in flists:
-            expname=fd['expname']
-            ccd=fd['ccd']
+        import numpy
 
-            fd['run'] = self['run']
-            if 'red_bkg' in fd:
-                # in this case we already have what we need
-                fd['input_files'] = {'image': fd['red_image'],
-                                     'bkg':   fd['red_bkg'],
-                                     'cat':   fd['red_cat']}
-
-            else:
-                fd['bkg_url']=fd['image_url'].replace('.fits.fz','_bkg.fits.fz')
-                fd['cat_url']=fd['image_url'].replace('.fits.fz','_cat.fits')
-                fd['input_files'] = {'image':fd['image_url'],
-                                     'bkg':fd['bkg_url'],
-                                     'cat':fd['cat_url']}
-            fd['output_files']=self.get_se_outputs(self.filetypes,
-                                                   expname=expname,
-                                                   ccd=ccd)
-
-            fd['timeout'] = self.timeout
+        table = self.get_red_info().get_table()
 
+        if 'red_bkg' in table.dtype.names:
+            # in this case we already have what we need
+            input_cols={'image':'red_image',
+                        'bkg':'red_bkg',
+                        'cat':'red_cat'}
+        else:
+            image_url=table['image_url']
+            bkg_url=numpy.char.replace(image_url,'.fits.fz','_bkg.fits.fz')
+            cat_url=numpy.char.replace(image_url,'.fits.fz','_cat.fits')
+            table=eu.numpy_util.add_fields(table,
+                                           [('bkg_url',bkg_url.dtype.str),
+                                            ('cat_url',cat_url.dtype.str)])
+            table['bkg_url']=bkg_url
+            table['cat_url']=cat_url
+            input_cols={'image':'image_url',
+                        'bkg':'bkg_url',
+                        'cat':'cat_url'}
+
+        outputs=self._get_se_output_columns(table)
+
+        flists=SEJobList(self['run'], table, input_cols, outputs,
+                         timeout=self.timeout)
 
         self.flists = flists
         return flists
 
+    def _get_se_output_columns(self, table):
+        """
+        the output file names for all jobs, as arrays keyed by file type.
+        If flist_nprocs is set in the runconfig the work is split by
+        exposure over a pool of processes
+        """
+        import numpy
+
+        nprocs=self.rc.get('flist_nprocs',None)
+        expname=table['expname']
+        ccd=table['ccd']
+
+        if nprocs is None or nprocs <= 1:
+            return get_se_output_columns(self['run'], self.filetypes,
+                                         expname, ccd)
+
+        import multiprocessing
+
+        # split at exposure boundaries
+        s=expname.argsort(kind='mergesort')
+        uexp,ind=numpy.unique(expname[s], return_index=True)
+        bounds=ind[numpy.linspace(0, ind.size, nprocs+1)[1:-1].astype('i8')]
+        splits=numpy.split(s, bounds)
+
+        args=[(self['run'], self.filetypes, expname[w], ccd[w])
+              for w in splits if w.size > 0]
+
+        print 'getting outputs for',len(uexp),'exposures with', \
+                nprocs,'processes'
+        pool=multiprocessing.Pool(nprocs)
+        try:
+            res=pool.map(_get_se_output_columns_tuple, args)
+            pool.close()
+        finally:
+            pool.join()
+
+        outputs={}
+        for ftype in self.filetypes:
+            outputs[ftype]=numpy.zeros(table.size, dtype=object)
+        for w,cols in zip([w for w in splits if w.size > 0],res):
+            for ftype,col in cols.iteritems():
+                outputs[ftype][w]=col
+
+        return outputs
+
     def cache_flists_by_ccd(self):
         """
-        Get raw red info
+        Get raw red info as a list of dicts
+        """
+        return self.get_red_info().get_dicts()
+
+    def get_red_info(self):
+        """
+        Get the raw red info cache as a deswl.redinfo.RedInfo, generating
+        it if needed.  A red info list written by an older version is
+        converted
         """
         fname=self._df.url(type='wlpipe_flist_red', run=self['run'])
-        if not os.path.exists(fname):
-            print 'cache not found, generating raw red info list'
-            eu.ostools.makedirs_fromfile(fname)
-
-            release = self.rc['dataset']
-            bands = self.rc['band']
-            if 'coadd' in release[0]:
-                print 'getting runs/expnames associated with coadd'
-                flists = desdb.files.get_coadd_srclist_by_release(release, bands)
+        cache_dir=deswl.redinfo.get_cache_url(fname)
+        if not os.path.exists(cache_dir):
+            if os.path.exists(fname):
+                print 'reading red info list:',fname
+                flists = eu.io.read(fname)
             else:
-                flists = desdb.files.get_red_info_by_release(release, bands=bands)
-            print 'writing cache:',fname
-            eu.io.write(fname, flists)
-        else:
-            print 'reading cache:',fname
-            flists = eu.io.read(fname)
+                print 'cache not found, generating raw red info list'
+                eu.ostools.makedirs_fromfile(fname)
+
+                release = self.rc['dataset']
+                bands = self.rc['band']
+                if 'coadd' in release[0]:
+                    print 'getting runs/expnames associated with coadd'
+                    flists = deswl.querycache.get_coadd_srclist_by_release(release, bands)
+                else:
+                    flists = deswl.querycache.get_red_info_by_release(release, bands=bands)
 
-        return flists
+            print 'writing cache:',cache_dir
+            deswl.redinfo.write(cache_dir, flists)
+            del flists
+
+        print 'reading cache:',cache_dir
+        return deswl.redinfo.RedInfo(cache_dir)
 
 
     def get_se_outputs(self, filetypes, **keys):
@@ -986,37 +1401,72 @@ Queue
         ccd=keys['ccd']
         fdict={}
         for ftype in filetypes:
-            tinfo=filetypes[ftype]
-            ext=tinfo['ext']
-            if 'typename' in tinfo:
-                tname=tinfo['typename']
-            else:
-                tname=ftype
-            fdict[ftype] = self._df.url(type='wlpipe_se_generic',
-                                        run=self['run'],
-                                        expname=expname,
-                                        ccd=ccd,
-                                        filetype=tname,
-                                        ext=ext)
+            fdict[ftype] = get_se_output_url(self._paths,
+                                             self['run'],
+                                             ftype,
+                                             filetypes[ftype],
+                                             expname,
+                                             ccd)
         return fdict
 
 
-    def _write_meta_and_script_single(self, fd):
+    def _write_meta_and_script_single(self, fd, writer=None, manifest=None):
+        """
+        write the meta file and script for a job.  If a ScriptWriter is
+        sent, the writes are done through its thread pool.
+
+        If a JobManifest is sent, the meta data are added to it under the
+        job key instead of being written to a separate file
+        """
+
+        if manifest is not None:
+            jobid=deswl.manifest.get_job_key(fd)
+            meta_file=None
+            del fd['output_files']['meta']
+            fd['manifest']=manifest.path
+            fd['jobid']=jobid
+        else:
+            # this is in the output directory, so we are good from
+            # here on!
+            meta_file=fd['output_files']['meta']
 
-        # this is in the output directory, so we are good from
-        # here on!
-        meta_file=fd['output_files']['meta']
         script_file=fd['script']
 
-        eu.ostools.makedirs_fromfile(meta_file)
-        eu.ostools.makedirs_fromfile(script_file)
+        script_data=self.get_script(fd)
+
+        if manifest is not None:
+            manifest.add(jobid, self.get_job_name(fd), fd)
+        elif writer is not None:
+            writer.write_data(meta_file, fd)
+        else:
+            write_data(meta_file, fd)
+
+        if writer is not None:
+            writer.write_script(script_file, script_data)
+        else:
+            write_script(script_file, script_data)
+
+    def use_manifest(self):
+        """
+        True if the job meta data should go into a single manifest rather
+        than a file per job.  Set manifest=True in the constructor keywords
+        or in the runconfig
+        """
+        return self.get('manifest', self.rc.get('manifest',False))
 
-        eu.io.write(meta_file, fd)
+    def get_manifest_url(self):
+        return deswl.manifest.get_manifest_url(self['run'])
 
-        with open(script_file,'w') as fobj:
-            script_data=self.get_script(fd)
-            fobj.write(script_data)
-        os.system('chmod u+x %s' % script_file)
+    def _open_manifest(self):
+        """
+        open the manifest for adding jobs if we are in manifest mode,
+        otherwise return None.  Existing entries for other jobs are kept
+        """
+        if not self.use_manifest():
+            return None
+
+        path=self.get_manifest_url()
+        return deswl.manifest.JobManifest(path, mode='a')
 
 
 
@@ -1064,44 +1514,99 @@ Queue
                      cmd=cmd)
 
        
-        eu.ostools.makedirs_fromfile(minion_file)
-        with open(minion_file,'w') as fobj:
-            fobj.write(text)
-        os.system('chmod u+x %s' % minion_file)
+        write_script(minion_file, text)
+
+    def get_timing_model(self):
+        """
+        The timing model for the run type, used if walltime_percentile is set
+        in the runconfig.  None is returned if not set or there are no
+        timings
+        """
+        if self.rc.get('walltime_percentile',None) is None:
+            return None
+
+        if not hasattr(self, '_timing_model'):
+            model=deswl.walltime.TimingModel(self.rc['run_type'])
+            if model.get_nsamples() == 0:
+                print 'no timings found for',self.rc['run_type']
+                model=None
+            self._timing_model=model
+
+        return self._timing_model
+
+    def predict_job_seconds(self, fd):
+        """
+        The predicted seconds for the job from the timing model, falling
+        back to seconds_per
+        """
+        model=self.get_timing_model()
+        if model is not None:
+            percentile=self.rc['walltime_percentile']
+            seconds=model.predict(fd, percentile=percentile)
+            if seconds is not None:
+                return seconds
+
+        return self.seconds_per
 
-    def calc_walltime_job(self):
-        if hasattr(self, 'walltime_job_hours'):
+    def calc_walltime_job(self, fdict=None):
+        """
+        If the fdict is sent and there is a timing model, use
+        the predicted time for the job
+        """
+        if fdict is not None and self.get_timing_model() is not None:
+            seconds_per_job=self.predict_job_seconds(fdict)
+        elif hasattr(self, 'walltime_job_hours'):
             return self.walltime_job_hours
         else:
             seconds_per_job=self.seconds_per
-            walltime_hours=seconds_per_job/3600.
-            walltime_hours=int(ceil(walltime_hours))
-            return walltime_hours
-
 
+        walltime_hours=seconds_per_job/3600.
+        walltime_hours=int(ceil(walltime_hours))
+        return walltime_hours
 
-    def calc_minions_walltime(self, ncpu, njobs=None, check=False):
+    def calc_minions_walltime(self, ncpu, njobs=None, check=False,
+                              flists=None):
         """
         If njobs is not sent, then the length entire list is used
 
         If check=True, use the time expected
         to for each check
+
+        If there is a timing model the walltime is the predicted total
+        over the jobs, from flists if sent, divided by ncpu but no
+        less than the longest job
         """
 
-        if njobs is None:
-            flists=self.get_flists()
-            njobs = len(flists)
+        use_model=(not check
+                   and self.get_timing_model() is not None
+                   and (flists is not None or njobs is None))
+        if use_model:
+            if flists is None:
+                flists=self.get_flists()
 
-        if check:
-            seconds_per=self.seconds_per_check
+            times=[self.predict_job_seconds(fd) for fd in flists]
+            njobs=len(times)
+            total_time=sum(times)
+
+            walltime_seconds = total_time/ncpu
+            if njobs > 0:
+                walltime_seconds = max(walltime_seconds, max(times))
         else:
-            seconds_per=self.seconds_per
+            if njobs is None:
+                if flists is None:
+                    flists=self.get_flists()
+                njobs = len(flists)
+
+            if check:
+                seconds_per=self.seconds_per_check
+            else:
+                seconds_per=self.seconds_per
 
-        total_time=seconds_per*njobs
+            total_time=seconds_per*njobs
 
-        # the walltime in seconds given our
-        # ncpu
-        walltime_seconds = total_time/ncpu
+            # the walltime in seconds given our
+            # ncpu
+            walltime_seconds = total_time/ncpu
 
         walltime_hours=walltime_seconds/3600.
         walltime_hours=int(ceil(walltime_hours))
@@ -1112,31 +1617,108 @@ Queue
         print '  walltime:',walltime
         return walltime
 
-    def write_sub_minions(self, job_file, commands_file, njobs):
+    def calc_bin_walltime(self, ncpu, costs):
+        """
+        The walltime for a bin from the predicted cost of its jobs, the
+        summed cost divided by ncpu but no less than the longest job
+        """
+        walltime_seconds = max(sum(costs)/float(ncpu), max(costs))
+
+        walltime_hours=walltime_seconds/3600.
+        walltime_hours=int(ceil(walltime_hours))
+
+        walltime='%d:00:00' % walltime_hours
+        print '  njobs:',len(costs)
+        print '  ncpu:',ncpu
+        print '  walltime:',walltime
+        return walltime
+
+    def write_sub_minions(self, job_file, commands_file, njobs, flists=None,
+                          nodes=None, walltime=None, job_name=None):
         ppn=self.rc.get('ppn',None)
         if ppn is not None:
-            self.write_sub_minions_pbs(job_file, commands_file, njobs)
+            self.write_sub_minions_pbs(job_file, commands_file, njobs,
+                                       flists=flists, nodes=nodes,
+                                       walltime=walltime, job_name=job_name)
         else:
             self.write_sub_minions_wq(job_file, commands_file, njobs)
 
     def write_sub_minions_wq(self, job_file, commands_file, njobs):
-        print 'no wq minions submit available yet'
-        pass
+        """
+        Batching individual jobs on a single node with deswl-exec
+
+        The number of processes is nprocs from the runconfig, default
+        all cpus on the node
+        """
+        rc=self.rc
+        job_name='%s-exec' % self['run']
+
+        nprocs=rc.get('nprocs',None)
+        if nprocs is not None:
+            jstr='-j %d ' % nprocs
+        else:
+            jstr=''
+
+        wq_text="""
+command: |
+    source ~/.bashrc
+    deswl-exec {jstr}{commands_file}
+
+job_name: {job_name}
+
+mode: bynode
+        \n"""
+
+        wq_text=wq_text.format(jstr=jstr,
+                               commands_file=commands_file,
+                               job_name=job_name)
+
+        print 'Writing wq exec file for',njobs,'jobs:',job_file
+        eu.ostools.makedirs_fromfile(job_file)
+        with open(job_file,'w') as fobj:
+            fobj.write(wq_text)
 
-    def write_sub_minions_pbs(self, job_file, commands_file, njobs):
+    def write_sub_minions_pbs(self, job_file, commands_file, njobs,
+                              flists=None, nodes=None, walltime=None,
+                              job_name=None):
         """
         Batching individual jobs using mpi
 
-        requires the program minions installed
+        requires the program minions installed.  Send the flists for
+        the commands to use predicted walltimes.  nodes defaults to
+        the value in the runconfig.  walltime and job_name are calculated
+        if not sent
+
+        If pbs_exec is set in the runconfig, the commands are instead run
+        with deswl-exec, which journals finished commands so a job killed
+        at the walltime only reruns the unfinished ones when resubmitted.
+        deswl-exec runs on a single node, so nodes must be 1.  minions
+        keeps no journal and reruns every command
         """
         rc=self.rc
-        job_name='%s-minions' % self['run']
-        nodes=rc['nodes']
+        if job_name is None:
+            job_name='%s-minions' % self['run']
+        if nodes is None:
+            nodes=rc['nodes']
         ppn=rc['ppn']
         ncpu=nodes*ppn
 
-        print 'calculating wall time'
-        walltime=self.calc_minions_walltime(ncpu, njobs=njobs)
+        cbase=os.path.basename(commands_file)
+        if rc.get('pbs_exec',False):
+            if nodes != 1:
+                raise ValueError("pbs_exec requires a single node, "
+                                 "got nodes=%d" % nodes)
+            run_text=('deswl-exec -j %d %s\n\n'
+                      'echo "done deswl-exec"' % (ppn,cbase))
+        else:
+            run_text=('module load openmpi-gnu\n'
+                      'mpirun -np %d minions < %s\n\n'
+                      'echo "done minions"' % (ncpu,cbase))
+
+        if walltime is None:
+            print 'calculating wall time'
+            walltime=self.calc_minions_walltime(ncpu, njobs=njobs,
+                                                flists=flists)
 
         queue=self.get('queue','regular')
 
@@ -1152,20 +1734,15 @@ if [[ "Y${{PBS_O_WORKDIR}}" != "Y" ]]; then
     cd $PBS_O_WORKDIR
 fi
 
-module load openmpi-gnu
-mpirun -np {ncpu} minions < {commands_file}
-
-echo "done minions"
+{run_text}
         \n"""
 
-        cbase=os.path.basename(commands_file)
         minions_text=minions_text.format(job_name=job_name,
                                          nodes=nodes,
                                          ppn=ppn,
-                                         ncpu=ncpu,
                                          walltime=walltime,
                                          queue=queue,
-                                         commands_file=cbase,
+                                         run_text=run_text,
                                          job_file=job_file)
 
         print 'Writing minions pbs file:',job_file
@@ -1277,11 +1854,242 @@ echo "done minions"
 
 
 
+    def _load_nrows_index(self, cat_files):
+        """
+        load the row count index for this run and bring it up to date
+        for the input catalogs
+        """
+        d=self._paths.dir(type='wlpipe_flists', run=self['run'])
+        path=os.path.join(d, '%s-nrows-index.json' % self['run'])
+
+        nthreads=self.get('nthreads',NTHREADS)
+        self._nrows_index=NrowsIndex(path)
+        self._nrows_index.probe(cat_files, nthreads=nthreads)
+        self._nrows_index.write()
+
     def _get_nrows(self, cat_file):
-        import fitsio
-        with fitsio.FITS(cat_file) as fobj:
-            nrows=fobj[1].get_nrows()
-        return nrows
+        nrows_index=getattr(self, '_nrows_index', None)
+        if nrows_index is not None and cat_file in nrows_index:
+            return nrows_index[cat_file]['nrows']
+
+        return read_nrows(cat_file)
+
+class MEJobList(object):
+    """
+    The multi-epoch jobs for a run.
+
+    The jobs are held as one shared record per tile and a table of chunks
+    with the tile index, start, end and nobj.  The job dicts are only built
+    when an element is accessed, including the output file names, so the
+    list is cheap to build and hold even for large splits.
+
+    Modifying a job dict does not alter the list.
+
+    parameters
+    ----------
+    scripts: GenericScripts
+        Used to generate the output file names
+    run: string
+        The run for the outputs
+    tiles: list of dicts
+        Records for each tile, including the input_files
+    chunks: array
+        Table from make_chunk_table; start and end are -1 for
+        jobs that are not split
+    """
+    def __init__(self, scripts, run, tiles, chunks):
+        self.scripts=scripts
+        self.run=run
+        self.tiles=tiles
+        self.chunks=chunks
+
+    def __len__(self):
+        return self.chunks.size
+
+    def __getitem__(self, i):
+        return self._make_job(self.chunks[i])
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield self._make_job(chunk)
+
+    def select_tile(self, tilename):
+        """
+        get a new MEJobList with only jobs for the specified tile
+        """
+        import numpy
+        itiles=[i for i,t in enumerate(self.tiles) if t['tilename']==tilename]
+        w,=numpy.where(numpy.in1d(self.chunks['itile'], itiles))
+        return MEJobList(self.scripts, self.run, self.tiles, self.chunks[w])
+
+    def get_tile_index(self):
+        """
+        get a dict keyed by tilename of the index of the first job for
+        the tile, without building the jobs
+        """
+        index={}
+        for i,itile in enumerate(self.chunks['itile'].tolist()):
+            index.setdefault(self.tiles[itile]['tilename'], i)
+        return index
+
+    def collect_by_tile(self):
+        """
+        get a dict of MEJobList keyed by tilename
+        """
+        import numpy
+        d={}
+        for itile in numpy.unique(self.chunks['itile']):
+            w,=numpy.where(self.chunks['itile']==itile)
+            tilename=self.tiles[itile]['tilename']
+            d[tilename] = MEJobList(self.scripts, self.run,
+                                    self.tiles, self.chunks[w])
+        return d
+
+    def _make_job(self, chunk):
+        tile=self.tiles[chunk['itile']]
+
+        fd=copy.copy(tile)
+        fd['input_files']=copy.copy(tile['input_files'])
+
+        if chunk['start'] < 0:
+            start,end,nobj=None,None,None
+        else:
+            start=int(chunk['start'])
+            end=int(chunk['end'])
+            nobj=int(chunk['nobj'])
+
+        self.scripts._set_me_outputs(self.run,
+                                     fd,
+                                     self.scripts.filetypes,
+                                     start=start,
+                                     end=end)
+        fd['start']=start
+        fd['end']=end
+        fd['nobj']=nobj
+        return fd
+
+class SEJobList(object):
+    """
+    The single epoch jobs for a run.
+
+    The jobs are held as a table of the red info, with the input and output
+    file names as columns.  The job dicts are only built when an element is
+    accessed.
+
+    Modifying a job dict does not alter the list.
+
+    parameters
+    ----------
+    run: string
+        The run for the outputs
+    table: array
+        The red info table from the red info cache, including the input file
+        columns
+    input_cols: dict
+        The column for each input file type
+    outputs: dict
+        Arrays of the output file names, keyed by file type
+    timeout: optional
+        The timeout for each job
+    """
+    def __init__(self, run, table, input_cols, outputs, timeout=None):
+        self.run=run
+        self.table=table
+        self.input_cols=input_cols
+        self.outputs=outputs
+        self.timeout=timeout
+
+        self._names=table.dtype.names
+
+    def __len__(self):
+        return self.table.size
+
+    def __getitem__(self, i):
+        return self._make_job(i)
+
+    def __iter__(self):
+        for i in xrange(self.table.size):
+            yield self._make_job(i)
+
+    def _make_job(self, i):
+        fd=dict( zip(self._names, self.table[i].tolist()) )
+
+        fd['run'] = self.run
+        fd['input_files']=dict( (ftype, fd[col])
+                                for ftype,col in self.input_cols.iteritems() )
+        fd['output_files']=dict( (ftype, str(col[i]))
+                                 for ftype,col in self.outputs.iteritems() )
+        fd['timeout'] = self.timeout
+        return fd
+
+class NrowsIndex(dict):
+    """
+    Row counts for a set of fits catalogs, keyed by path.
+
+    The mtime and size of each file are stored along with the row count,
+    and the count is only re-read if these change.  The index is stored as
+    a small json file.
+
+    parameters
+    ----------
+    path: string
+        Path to the index file.  It is read if it exists.
+    """
+    def __init__(self, path):
+        self.path=path
+        if os.path.exists(path):
+            print 'reading nrows index:',path
+            data=eu.io.read(path)
+            self.update(data)
+
+    def probe(self, fnames, nthreads=NTHREADS):
+        """
+        Get the row counts for the input files, using a pool of threads.
+        Only files not in the index, or that changed, are read.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        fnames=list(set(fnames))
+        print 'probing nrows for',len(fnames),'files with',nthreads,'threads'
+
+        pool=ThreadPool(nthreads)
+        try:
+            entries=pool.map(self._probe_one, fnames)
+        finally:
+            pool.close()
+            pool.join()
+
+        nread=0
+        for fname,entry in zip(fnames,entries):
+            if entry is not self.get(fname,None):
+                nread += 1
+            self[fname] = entry
+
+        print '    read %d/%d headers' % (nread,len(fnames))
+
+    def write(self):
+        """
+        write the index, going through a temporary file
+        """
+        eu.ostools.makedirs_fromfile(self.path)
+
+        tmp_path='%s.tmp-%d' % (self.path, os.getpid())
+        eu.io.write(tmp_path, dict(self), type='json', clobber=True)
+        os.rename(tmp_path, self.path)
+
+    def _probe_one(self, fname):
+        st=os.stat(fname)
+        mtime=int(st.st_mtime)
+
+        entry=self.get(fname,None)
+        if (entry is not None
+                and entry['mtime']==mtime
+                and entry['size']==st.st_size):
+            return entry
+
+        return {'nrows':read_nrows(fname),
+                'mtime':mtime,
+                'size':st.st_size}
 
 class GenericSEPBSJob(dict):
     """
@@ -1299,6 +2107,10 @@ class GenericSEPBSJob(dict):
         self['ccd'] = ccd
         self['queue'] = keys.get('queue','serial')
 
+        # for manifest mode
+        self['manifest'] = keys.get('manifest',None)
+        self['jobid'] = keys.get('jobid',None)
+
         df=desdb.files.DESFiles()
         self._df=df
 
@@ -1325,7 +2137,11 @@ class GenericSEPBSJob(dict):
         self['esutil_load'] = \
             'module unload esutil && module load esutil/%s' % ver
 
-    def write(self, check=False):
+    def write(self, check=False, writer=None):
+        """
+        write the script.  If a ScriptWriter is sent, the write
+        is done through its thread pool
+        """
 
         run=self['run']
         expname=self['expname']
@@ -1355,13 +2171,9 @@ class GenericSEPBSJob(dict):
             chk=job_file[0:job_file.rfind('.')]+'.json'
             err=job_file[0:job_file.rfind('.')]+'.err'
 
-            cmd="""
-meta="{meta}"
-chk="{chk}"
-err="{err}"
-deswl-check "$meta" 1> "$chk" 2> "$err"
-"""
-            cmd=cmd.format(meta=meta, chk=chk, err=err)
+            cmd=get_check_command(meta, chk, err,
+                                  manifest=self['manifest'],
+                                  jobid=self['jobid'])
         else:
             # log is now automatically created by GenericProcessor
             # and written into hdfs
@@ -1398,11 +2210,10 @@ nsetup_ess
                  'job_name':job_name}
 
 
-        eu.ostools.makedirs_fromfile(job_file)
-        with open(job_file,'w') as fobj:
-            fobj.write(text)
-
-        os.system('chmod u+x %s' % job_file)
+        if writer is not None:
+            writer.write_script(job_file, text)
+        else:
+            write_script(job_file, text)
 
 
 
@@ -1411,6 +2222,9 @@ class GenericMEChecker(dict):
     Write out scripts that are also PBS scripts for checking outputs.
 
     I've been calling these as minions at nersc
+
+    For large runs prefer deswl-check --run, which checks all jobs in one
+    process and only re-evaluates jobs whose files changed
     """
     def __init__(self, run, tilename, band, start=None, end=None,
                  **keys):
@@ -1420,6 +2234,10 @@ class GenericMEChecker(dict):
         self['band'] = band
         self['queue'] = keys.get('queue','serial')
 
+        # for manifest mode
+        self['manifest'] = keys.get('manifest',None)
+        self['jobid'] = keys.get('jobid',None)
+
         start,end=extract_start_end(start=start,end=end)
         self['start']=start
         self['end']=end
@@ -1459,7 +2277,11 @@ class GenericMEChecker(dict):
         self['esutil_load'] = \
             'module unload esutil && module load esutil/%s' % ver
 
-    def write(self):
+    def write(self, writer=None):
+        """
+        write the script.  If a ScriptWriter is sent, the write
+        is done through its thread pool
+        """
 
         run=self['run']
         tilename=self['tilename']
@@ -1488,13 +2310,9 @@ class GenericMEChecker(dict):
         chk=job_file[0:job_file.rfind('.')]+'.json'
         err=job_file[0:job_file.rfind('.')]+'.err'
 
-        cmd="""
-meta="{meta}"
-chk="{chk}"
-err="{err}"
-deswl-check "$meta" 1> "$chk" 2> "$err"
-"""
-        cmd=cmd.format(meta=meta, chk=chk, err=err)
+        cmd=get_check_command(meta, chk, err,
+                              manifest=self['manifest'],
+                              jobid=self['jobid'])
 
         # need -l for login shell because of all the crazy module stuff
         # we have to load
@@ -1527,17 +2345,233 @@ nsetup_ess
                  'job_name':job_name}
 
 
-        eu.ostools.makedirs_fromfile(job_file)
-        with open(job_file,'w') as fobj:
-            fobj.write(text)
+        if writer is not None:
+            writer.write_script(job_file, text)
+        else:
+            write_script(job_file, text)
+
+
+
+class ScriptWriter(object):
+    """
+    Write scripts and data files through a bounded pool of threads.
+
+    At most maxqueue writes are pending at any time, so the text for all
+    jobs is never held in memory at once.  Errors in the writes are raised
+    when the writer is closed.
+
+    Use as a context manager
+
+        with ScriptWriter(nthreads=16) as writer:
+            for fd in flists:
+                writer.write_script(fd['script'], text)
+    """
+    def __init__(self, nthreads=NTHREADS, maxqueue=None):
+        from multiprocessing.pool import ThreadPool
+
+        if maxqueue is None:
+            maxqueue=4*nthreads
+
+        self._pool=ThreadPool(nthreads)
+        self._slots=threading.BoundedSemaphore(maxqueue)
+        self._errors=[]
+
+    def write_script(self, path, text, who='u'):
+        """
+        write the text and make the file executable, see write_script()
+        """
+        self._submit(write_script, path, text, who)
+
+    def write_data(self, path, data):
+        """
+        write data with eu.io.write, see write_data()
+        """
+        self._submit(write_data, path, data)
 
-        os.system('chmod u+x %s' % job_file)
+    def close(self):
+        """
+        wait for all writes to finish
+        """
+        self._pool.close()
+        self._pool.join()
+
+        if len(self._errors) > 0:
+            raise RuntimeError("%d writes failed, first error "
+                               "was: %s" % (len(self._errors),self._errors[0]))
+
+    def _submit(self, func, *args):
+        self._slots.acquire()
+        self._pool.apply_async(self._run, (func,)+args)
 
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception as err:
+            self._errors.append('%s: %s' % (args[0], err))
+        finally:
+            self._slots.release()
 
+    def __enter__(self):
+        return self
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+_made_dirs=set()
+_made_dirs_lock=threading.Lock()
+
+def makedirs_fromfile(path):
+    """
+    make the directory for the input file if it does not exist.  Directories
+    we have made or seen are remembered, so the file system is only checked
+    once per directory
+    """
+    d=os.path.dirname(path)
+    if d=='' or d in _made_dirs:
+        return
+
+    if not os.path.exists(d):
+        try:
+            os.makedirs(d)
+        except OSError:
+            # possibly a race condition
+            if not os.path.isdir(d):
+                raise
+
+    with _made_dirs_lock:
+        _made_dirs.add(d)
+
+_EXEC_BITS={'u':stat.S_IXUSR,
+            'a':stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH}
+
+def write_script(path, text, who='u'):
+    """
+    Write the text to the path and add the executable bits, like chmod u+x
+    or with who='a' chmod a+x.  The mode is set on the open descriptor, so
+    no process is forked
+    """
+    makedirs_fromfile(path)
+
+    fd=os.open(path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0666)
+    with os.fdopen(fd,'w') as fobj:
+        fobj.write(text)
+
+        mode=os.fstat(fd).st_mode
+        os.fchmod(fd, stat.S_IMODE(mode) | _EXEC_BITS[who])
+
+def write_data(path, data):
+    """
+    write the data using eu.io.write, making the directory as needed
+    """
+    makedirs_fromfile(path)
+    eu.io.write(path, data)
+
+def get_se_output_url(paths, run, ftype, tinfo, expname, ccd):
+    """
+    the output file name for a single epoch job
+    """
+    ext=tinfo['ext']
+    if 'typename' in tinfo:
+        tname=tinfo['typename']
+    else:
+        tname=ftype
+    return paths.url(type='wlpipe_se_generic',
+                     run=run,
+                     expname=expname,
+                     ccd=ccd,
+                     filetype=tname,
+                     ext=ext)
+
+def get_se_output_columns(run, filetypes, expname, ccd):
+    """
+    the output file names for arrays of expname and ccd, as arrays
+    keyed by file type
+    """
+    import numpy
+
+    paths=deswl.pathtemplates.PathTemplates()
+
+    # plain python types for the templates
+    expname=expname.tolist()
+    ccd=ccd.tolist()
+
+    outputs={}
+    for ftype,tinfo in filetypes.iteritems():
+        urls=[get_se_output_url(paths, run, ftype, tinfo, e, c)
+              for e,c in zip(expname,ccd)]
+        outputs[ftype]=numpy.array(urls, dtype=object)
+
+    return outputs
+
+def _get_se_output_columns_tuple(args):
+    return get_se_output_columns(*args)
+
+def get_release_marker(coadd_info):
+    """
+    A short summary of the release coadd info, the number of coadds and a
+    hash of their runs and image ids, which changes when coadds are added,
+    removed or redone
+    """
+    import hashlib
+
+    ids=sorted( (c['coadd_run'],c['image_id']) for c in coadd_info )
+    text='\n'.join(['%s %s' % cid for cid in ids])
+    return {'ncoadd':len(ids),
+            'hash':hashlib.md5(text).hexdigest()}
+
+def get_tile_index(fdlist):
+    """
+    a dict keyed by tilename of the index of the first job for the tile
+    """
+    if isinstance(fdlist, MEJobList):
+        return fdlist.get_tile_index()
+
+    index={}
+    for i,fd in enumerate(fdlist):
+        index.setdefault(fd['tilename'], i)
+    return index
+
+def get_meds_key(fd):
+    """
+    The MEDS file or files read by a job, used to keep jobs reading
+    the same files together
+    """
+    if 'meds' in fd:
+        return fd['meds']
+
+    input_files=fd['input_files']
+    if 'meds' in input_files:
+        return input_files['meds']
+
+    return fd.get('tilename',None)
 
 def get_run_command(config_file):
     return 'deswl-run %s' % config_file
 
+def get_check_command(meta, chk, err, manifest=None, jobid=None):
+    """
+    The command to check a job, reading the meta data from the meta file or,
+    if sent, from the manifest by job key
+    """
+    if manifest is not None:
+        cmd="""
+manifest="{manifest}"
+jobid="{jobid}"
+chk="{chk}"
+err="{err}"
+deswl-check --manifest "$manifest" "$jobid" 1> "$chk" 2> "$err"
+"""
+        cmd=cmd.format(manifest=manifest, jobid=jobid, chk=chk, err=err)
+    else:
+        cmd="""
+meta="{meta}"
+chk="{chk}"
+err="{err}"
+deswl-check "$meta" 1> "$chk" 2> "$err"
+"""
+        cmd=cmd.format(meta=meta, chk=chk, err=err)
+
+    return cmd
+
 def extract_start_end(**keys):
     """
     get start and end as strings
@@ -1554,6 +2588,76 @@ def extract_start_end(**keys):
         end='%06d' % end
     return start, end
 
+def read_nrows(fname):
+    """
+    Get the number of rows in the first extension of a fits file, reading
+    only NAXIS2 from the header
+    """
+    import fitsio
+    hdr=fitsio.read_header(fname, ext=1)
+    return hdr['NAXIS2']
+
+def make_chunk_table(itile, start, end):
+    """
+    make the chunk table for MEJobList, with the nobj column calculated
+    from start and end.  start and end of -1 mean the whole tile
+    """
+    import numpy
+    dt=[('itile','i4'),
+        ('start','i8'),
+        ('end','i8'),
+        ('nobj','i8')]
+
+    chunks=numpy.zeros(len(itile), dtype=dt)
+    chunks['itile'] = itile
+    chunks['start'] = start
+    chunks['end'] = end
+    chunks['nobj'] = chunks['end'] - chunks['start'] + 1
+    return chunks
+
+def read_object_cost(meds_file, offset=COST_OFFSET):
+    """
+    Predicted relative cost of processing each object in a MEDS file,
+    ncutout*box_size**2 + offset, reading only those columns from the
+    object_data extension
+    """
+    import fitsio
+    data=fitsio.read(meds_file, ext='object_data',
+                     columns=['ncutout','box_size'])
+
+    box_size=data['box_size'].astype('f8')
+    cost = data['ncutout']*box_size**2 + offset
+    return cost
+
+def get_chunks_by_cost(cost, nper):
+    """
+    Split into chunks with roughly equal total cost.  The number of chunks
+    is the same as from get_chunks(cost.size, nper), or fewer if single
+    objects dominate.
+
+    These are not slices!
+    """
+    import numpy
+
+    nrow=cost.size
+    nchunk, nleft = divmod(nrow, nper)
+    if nleft != 0:
+        nchunk += 1
+
+    if nchunk <= 1:
+        return get_chunks(nrow, nper)
+
+    ccost=cost.cumsum()
+    targets=ccost[-1]*numpy.arange(1,nchunk)/float(nchunk)
+
+    # first object of each chunk after the first
+    bounds=numpy.searchsorted(ccost, targets, side='right')
+    bounds=numpy.unique( bounds.clip(1, nrow-1) )
+
+    startlist = [0] + bounds.tolist()
+    endlist = (bounds-1).tolist() + [nrow-1]
+    return startlist, endlist
+
 def get_chunks(nrow, nper):
     """
     These are not slices!
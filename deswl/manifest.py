@@ -0,0 +1,218 @@
+"""
+A single indexed file holding the job descriptors for a run.
+
+In manifest mode the meta data for every job are written into one sqlite
+database rather than a separate meta file per job.  Jobs are looked up by
+a key that does not depend on which jobs were written, e.g. by deswl-check
+
+    deswl-check --manifest $manifest $jobid
+
+The key is {tilename}-{band}-{start}-{end} for multi-epoch jobs and
+{expname}-{ccd} for single epoch jobs, see get_job_key.  Writing scripts
+for a subset of the jobs, e.g. a single tile, replaces the entries for those
+jobs and leaves the others in place.
+
+The database is in the wlpipe_run directory
+
+    $DESDATA/wlpipe/{run}/manifest/{run}-jobs.db
+
+and has a single table 'jobs' with columns
+
+    jobid     text, the job key
+    job_name  text
+    script    text, the path to the job script
+    status    text, the path to the status file
+    log       text, the path to the log file
+    meta      text, the full job dict as json
+"""
+import os
+import json
+import sqlite3
+from sys import stderr
+
+import desdb
+
+# number of jobs to insert in each transaction
+BATCH_SIZE=10000
+
+def get_manifest_dir(run):
+    df=desdb.files.DESFiles()
+    d=df.dir(type='wlpipe_run', run=run)
+    return os.path.join(d, 'manifest')
+
+def get_manifest_url(run):
+    d=get_manifest_dir(run)
+    name='%s-jobs.db' % run
+    return os.path.join(d, name)
+
+def get_job_key(fd):
+    """
+    the key for a job in the manifest
+    """
+    if 'tilename' in fd:
+        band=fd['band']
+        if isinstance(band,list):
+            band=','.join(band)
+        parts=[fd['tilename'], band, fd.get('start',None), fd.get('end',None)]
+    else:
+        parts=[fd['expname'], fd['ccd']]
+
+    return '-'.join(['%s' % p for p in parts])
+
+def read_job(path, jobid):
+    """
+    read the job dict for the specified jobid
+    """
+    with JobManifest(path) as manifest:
+        return manifest.read(jobid)
+
+class JobManifest(object):
+    """
+    Read and write the job manifest for a run.
+
+    parameters
+    ----------
+    path: string
+        Path to the sqlite database
+    mode: string, optional
+        'r' to read an existing manifest, 'w' to create a new
+        one, removing any existing file, 'a' to add to or replace
+        jobs in an existing manifest, creating it if needed.  Default 'r'
+    """
+    def __init__(self, path, mode='r'):
+        self.path=path
+        self.mode=mode
+
+        if mode=='w':
+            self._create()
+        elif mode=='a':
+            if os.path.exists(path) and self._has_current_schema():
+                print >>stderr,'updating manifest:',path
+                self.conn=sqlite3.connect(path)
+            else:
+                self._create()
+        elif mode=='r':
+            if not os.path.exists(path):
+                raise IOError("manifest not found: %s" % path)
+            self.conn=sqlite3.connect(path)
+        else:
+            raise ValueError("mode should be 'r', 'w' or 'a', got '%s'" % mode)
+
+        self._pending=[]
+
+    def add(self, jobid, job_name, fd):
+        """
+        add a job.  The inserts are done in batches
+        """
+        outf=fd['output_files']
+        row=(jobid,
+             job_name,
+             fd.get('script',None),
+             outf.get('status',None),
+             outf.get('log',None),
+             json.dumps(fd))
+        self._pending.append(row)
+
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        insert any pending jobs
+        """
+        if len(self._pending) == 0:
+            return
+
+        query="insert or replace into jobs values (?, ?, ?, ?, ?, ?)"
+        curs=self.conn.cursor()
+        curs.executemany(query, self._pending)
+        curs.close()
+        self.conn.commit()
+
+        self._pending=[]
+
+    def read(self, jobid):
+        """
+        read the job dict for the specified jobid
+        """
+        query="select meta from jobs where jobid = ?"
+        curs=self.conn.cursor()
+        curs.execute(query, (jobid,))
+        res=curs.fetchone()
+        curs.close()
+
+        if res is None:
+            raise ValueError("job %s not found in manifest %s" % (jobid,self.path))
+
+        return json.loads(res[0])
+
+    def __len__(self):
+        curs=self.conn.cursor()
+        curs.execute("select count(*) from jobs")
+        n=curs.fetchone()[0]
+        curs.close()
+        return n
+
+    def __iter__(self):
+        """
+        iterate over the job dicts in order of jobid
+        """
+        curs=self.conn.cursor()
+        curs.execute("select meta from jobs order by jobid")
+        for res in curs:
+            yield json.loads(res[0])
+        curs.close()
+
+    def close(self):
+        if self.mode in ['w','a']:
+            self.flush()
+        self.conn.close()
+
+    def _create(self):
+        d=os.path.dirname(self.path)
+        if not os.path.exists(d):
+            print >>stderr,'making dir:',d
+            os.makedirs(d)
+
+        if os.path.exists(self.path):
+            print >>stderr,'removing existing:',self.path
+            os.remove(self.path)
+
+        print >>stderr,'writing manifest:',self.path
+        self.conn=sqlite3.connect(self.path)
+
+        q="""
+create table jobs (
+    jobid text primary key,
+    job_name text,
+    script text,
+    status text,
+    log text,
+    meta text
+)
+        """
+        curs=self.conn.cursor()
+        curs.execute(q)
+        curs.close()
+        self.conn.commit()
+
+    def _has_current_schema(self):
+        """
+        manifests from older versions were keyed by integer index; those
+        are replaced
+        """
+        conn=sqlite3.connect(self.path)
+        try:
+            curs=conn.cursor()
+            curs.execute("pragma table_info(jobs)")
+            types=dict( (row[1],row[2].lower()) for row in curs )
+            curs.close()
+        finally:
+            conn.close()
+
+        return types.get('jobid',None) == 'text'
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
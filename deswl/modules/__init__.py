@@ -1,3 +1,5 @@
+import deswl
+
 from . import shapelets
 from . import im3shape
 
@@ -10,3 +12,62 @@ from . import hizqso
 
 from . import gmix_fit_meds
 from . import gmix_mcmc_meds
+
+def get_scripts_maker(run, master=False, queue='serial'):
+    """
+    Get the object that writes and lists the jobs for the run, based on
+    the run_type
+
+    parameters
+    ----------
+    run: string
+        The run identifier
+    master: bool, optional
+        Get the master version for writing command lists
+    queue: string, optional
+        The queue, used by some single epoch run types
+
+    returns
+    -------
+    cfobj, is_se: the scripts object and True if this is a
+    single epoch run
+    """
+    rc=deswl.files.Runconfig(run)
+
+    # this is a mess!
+
+    is_se=True
+    run_type=rc['run_type']
+    if run_type == 'sse':
+        cfobj = shapelets.ShapeletsSEScripts(run)
+    elif run_type == 'impyp':
+        cfobj = impyp.ImpypConfig(run, queue=queue)
+    elif run_type == 'am':
+        cfobj = am.AMConfig(run, queue=queue)
+    elif run_type == 'i3me':
+        is_se=False
+        cfobj = im3shape.I3MEScripts(run)
+
+    elif run_type == 'gfme':
+        is_se=False
+        if 'mcmeds' in rc['config']:
+            cfobj = gmix_mcmc_meds.GMixMCMCMEScripts(run)
+        else:
+            if master:
+                cfobj = gmix_fit_meds.GMixFitMEMaster(run)
+            else:
+                cfobj = gmix_fit_meds.GMixFitMEScripts(run)
+
+    elif run_type=='gmme':
+        is_se=False
+        if master:
+            cfobj = gmix_mcmc_meds.GMixMCMCMaster(run)
+        else:
+            raise ValueError("don't support non-master")
+
+    elif run_type == 'eye_se':
+        cfobj = eyeball.EyeballScripts(run)
+    else:
+        raise ValueError("unsupported run type: '%s'" % rc['run_type'])
+
+    return cfobj, is_se
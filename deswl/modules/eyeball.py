@@ -193,14 +193,13 @@ class SqliteMaker(object):
 
     def populate_files_table(self):
         import desdb
-        import esutil as eu
 
         print 'populating files table'
         df=desdb.files.DESFiles()
 
-        fname=df.url(type='wlpipe_flist_red', run=self.run)
-        print 'reading red info list:',fname
-        red_info = eu.io.read(fname)
+        # generates the red info cache if it is not there
+        ri=EyeballScripts(self.run).get_red_info()
+        red_info = ri.get_dicts(columns=['expname','ccd','band'])
 
         nf=len(red_info)
         nmissing=0
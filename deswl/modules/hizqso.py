@@ -150,5 +150,5 @@ class HiZQSO(object):
 
     def set_runs(self):
         print 'setting runs'
-        self.allruns = desdb.files.get_release_runs(self.conf['release'])
+        self.allruns = deswl.querycache.get_release_runs(self.conf['release'])
 
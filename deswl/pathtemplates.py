@@ -0,0 +1,150 @@
+"""
+Compiled path templates for desdb.files.DESFiles urls.
+
+Generating the url for every file of every job through DESFiles.url is slow
+for large runs, since each call expands the generic template and looks up
+the environment.  Instead, the url is generated once for each type with
+sentinel values for the string keywords, e.g. tilename and band, and the
+sentinels are replaced by format fields.  Later urls are a simple string
+format.
+
+Keywords that are not strings, such as an integer ccd or None for start and
+end, are fixed in the template, so there is one template for each set of
+such values.  Each template is checked against DESFiles.url when it is
+compiled; if desdb treats the values in a way that can't be captured by a
+template, that type falls back to DESFiles.url.
+
+    paths=PathTemplates()
+    url=paths.url('wlpipe_me_log', run=run, tilename=tilename, band=band,
+                  start=start, end=end)
+"""
+import threading
+from collections import OrderedDict
+
+import desdb
+
+# maximum number of compiled templates and directories to keep
+MAXSIZE=10000
+
+_SENTINEL='@@deswl-%s@@'
+
+class PathTemplates(object):
+    """
+    Generate urls from compiled templates, falling back to DESFiles.url
+
+    parameters
+    ----------
+    df: DESFiles, optional
+        The DESFiles object to use, default a new one
+    maxsize: int, optional
+        Maximum number of templates and directories to cache
+    """
+    def __init__(self, df=None, maxsize=MAXSIZE):
+        if df is None:
+            df=desdb.files.DESFiles()
+        self._df=df
+
+        self._templates=LRUCache(maxsize)
+        self._dirs=LRUCache(maxsize)
+
+    def url(self, type=None, **keys):
+        """
+        Get the url, same call signature as DESFiles.url
+        """
+        skeys=[]
+        fixed=[]
+        for k,v in keys.iteritems():
+            if isinstance(v, basestring):
+                skeys.append(k)
+            else:
+                fixed.append( (k,v) )
+
+        skeys.sort()
+        fixed.sort()
+        tkey=(type, tuple(skeys), tuple(fixed))
+
+        template=self._templates.get(tkey, _MISSING)
+        if template is _MISSING:
+            template=self._compile(type, skeys, keys)
+            self._templates.set(tkey, template)
+
+        if template is None:
+            return self._df.url(type=type, **keys)
+
+        return template % keys
+
+    def dir(self, type=None, **keys):
+        """
+        Get the directory, same call signature as DESFiles.dir.  The
+        results are cached
+        """
+        dkey=(type, tuple(sorted(keys.iteritems())))
+        d=self._dirs.get(dkey, _MISSING)
+        if d is _MISSING:
+            d=self._df.dir(type=type, **keys)
+            self._dirs.set(dkey, d)
+        return d
+
+    def _compile(self, type, skeys, keys):
+        """
+        make the template, or None if it does not reproduce DESFiles.url
+        """
+        tkeys=dict(keys)
+        for k in skeys:
+            tkeys[k] = _SENTINEL % k
+
+        try:
+            turl=self._df.url(type=type, **tkeys)
+        except Exception:
+            # desdb may check the values
+            return None
+
+        template=turl.replace('%','%%')
+        for k in skeys:
+            template=template.replace(_SENTINEL % k, '%%(%s)s' % k)
+
+        if '@@' in template:
+            # a sentinel was altered
+            return None
+
+        expected=self._df.url(type=type, **keys)
+        if template % keys != expected:
+            return None
+
+        return template
+
+class LRUCache(object):
+    """
+    A simple thread safe least recently used cache
+
+    parameters
+    ----------
+    maxsize: int
+        Maximum number of entries
+    """
+    def __init__(self, maxsize):
+        self.maxsize=maxsize
+        self._data=OrderedDict()
+        self._lock=threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            val=self._data.pop(key)
+            self._data[key]=val
+            return val
+
+    def set(self, key, val):
+        with self._lock:
+            if key in self._data:
+                self._data.pop(key)
+            elif len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+            self._data[key]=val
+
+    def __len__(self):
+        return len(self._data)
+
+# marker for entries not in the cache; None is a valid template
+_MISSING=object()
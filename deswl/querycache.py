@@ -0,0 +1,260 @@
+"""
+A local cache of desdb query results.
+
+The release, coadd and red info queries only change when a release changes,
+but planning tools run them again and again.  Results are stored in an
+sqlite database keyed by a hash of the query function and its arguments,
+as compressed pickles.
+
+The cache is
+
+    $DESWL_CACHE_DIR/query-cache.db
+
+with DESWL_CACHE_DIR defaulting to $DESDATA/wlpipe/cache.  Entries expire
+after DEFAULT_TTL seconds; set DESWL_CACHE_TTL to change this, or to 0 to
+disable the cache.  Entries can be removed explicitly with invalidate(),
+e.g. after a release is changed
+
+    querycache.invalidate('get_release_runs')
+
+The wrappers take the same arguments as the desdb functions
+
+    runs=querycache.get_release_runs(release, withbands=withbands)
+    cf=querycache.load_coadd(coadd_run=coadd_run, band=band, srclist=True)
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import cPickle
+from sys import stderr
+
+# default seconds before entries expire, 30 days
+DEFAULT_TTL=30*24*3600.0
+
+CACHE_NAME='query-cache.db'
+
+# seconds to wait for other processes holding the database lock
+LOCK_TIMEOUT=60.0
+
+def get_cache_dir():
+    d=os.environ.get('DESWL_CACHE_DIR',None)
+    if d is None:
+        from . import files
+        d=os.path.join(files.get_wlpipe_dir(), 'cache')
+    return d
+
+def get_cache_url():
+    return os.path.join(get_cache_dir(), CACHE_NAME)
+
+def get_ttl():
+    ttl=os.environ.get('DESWL_CACHE_TTL',None)
+    if ttl is None:
+        return DEFAULT_TTL
+    return float(ttl)
+
+def get_key(name, args, kw):
+    """
+    the hash of the query name and arguments
+    """
+    data=cPickle.dumps( (name, args, sorted(kw.iteritems())), 2 )
+    return hashlib.sha1(data).hexdigest()
+
+class QueryCache(object):
+    """
+    The cache database
+
+    parameters
+    ----------
+    path: string, optional
+        The sqlite file, default from get_cache_url()
+    ttl: float, optional
+        Seconds before entries expire, default from get_ttl().  If zero
+        nothing is cached
+    """
+    def __init__(self, path=None, ttl=None):
+        if path is None:
+            path=get_cache_url()
+        if ttl is None:
+            ttl=get_ttl()
+
+        self.path=path
+        self.ttl=ttl
+
+        self._conn=None
+        self._pid=None
+        self._lock=threading.Lock()
+
+    def call(self, name, func, *args, **kw):
+        """
+        get the result of func(*args, **kw) from the cache, or call it
+        and store the result
+        """
+        return self.cached(name, args, kw, lambda: func(*args, **kw))
+
+    def cached(self, name, args, kw, compute):
+        """
+        get the value for the query name and arguments from the cache, or
+        call compute() and store the result
+        """
+        if self.ttl <= 0:
+            return compute()
+
+        key=get_key(name, args, kw)
+        found,value=self.get(key)
+        if found:
+            return value
+
+        value=compute()
+        self.set(key, name, value)
+        return value
+
+    def get(self, key):
+        """
+        returns found, value
+        """
+        with self._lock:
+            conn=self._get_conn()
+            row=conn.execute("SELECT created, value FROM cache WHERE key=?",
+                             (key,)).fetchone()
+
+        if row is None:
+            return False, None
+
+        created,value=row
+        if time.time()-created > self.ttl:
+            return False, None
+
+        return True, cPickle.loads(zlib.decompress(str(value)))
+
+    def set(self, key, name, value):
+        """
+        store a value.  Values that cannot be pickled are not cached
+        """
+        try:
+            data=zlib.compress(cPickle.dumps(value, 2))
+        except (cPickle.PicklingError,TypeError) as err:
+            print >>stderr,'not caching %s: %s' % (name,err)
+            return
+
+        with self._lock:
+            conn=self._get_conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO cache VALUES (?,?,?,?)",
+                             (key, name, time.time(), sqlite3.Binary(data)))
+
+    def invalidate(self, name=None):
+        """
+        remove the entries for the named query, or all entries
+        """
+        with self._lock:
+            conn=self._get_conn()
+            with conn:
+                if name is None:
+                    conn.execute("DELETE FROM cache")
+                else:
+                    conn.execute("DELETE FROM cache WHERE name=?", (name,))
+
+    def _get_conn(self):
+        """
+        connections are not shared with forked processes
+        """
+        if self._conn is None or self._pid != os.getpid():
+            d=os.path.dirname(self.path)
+            if d != '' and not os.path.exists(d):
+                try:
+                    os.makedirs(d)
+                except OSError:
+                    pass
+
+            conn=sqlite3.connect(self.path, timeout=LOCK_TIMEOUT,
+                                 check_same_thread=False)
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                             "(key TEXT PRIMARY KEY, name TEXT, "
+                             "created REAL, value BLOB)")
+                conn.execute("CREATE INDEX IF NOT EXISTS cache_name_idx "
+                             "ON cache (name)")
+            self._conn=conn
+            self._pid=os.getpid()
+
+        return self._conn
+
+_cache=None
+
+def get_cache():
+    """
+    the cache for this process
+    """
+    global _cache
+    if _cache is None:
+        _cache=QueryCache()
+    return _cache
+
+def invalidate(name=None):
+    """
+    remove the entries for the named query, or all entries
+    """
+    get_cache().invalidate(name)
+
+def get_release_runs(*args, **kw):
+    import desdb
+    return get_cache().call('get_release_runs',
+                            desdb.files.get_release_runs,
+                            *args, **kw)
+
+def get_coadd_info_by_release(*args, **kw):
+    import desdb
+    return get_cache().call('get_coadd_info_by_release',
+                            desdb.files.get_coadd_info_by_release,
+                            *args, **kw)
+
+def get_coadd_srclist_by_release(*args, **kw):
+    import desdb
+    return get_cache().call('get_coadd_srclist_by_release',
+                            desdb.files.get_coadd_srclist_by_release,
+                            *args, **kw)
+
+def get_red_info_by_release(*args, **kw):
+    import desdb
+    return get_cache().call('get_red_info_by_release',
+                            desdb.files.get_red_info_by_release,
+                            *args, **kw)
+
+def load_coadd(srclist=False, conn=None, **keys):
+    """
+    make and load a desdb.files.Coadd, using the cache
+
+    parameters
+    ----------
+    srclist: bool, optional
+        Also load the srclist
+    conn: optional
+        The connection to use on a cache miss, default the shared
+        connection
+    **keys:
+        Keywords for Coadd, e.g. coadd_run and band
+    """
+    import desdb
+    from . import dbpool
+
+    if conn is None:
+        conn=dbpool.get_shared()
+
+    cf=desdb.files.Coadd(conn=conn, **keys)
+
+    def load():
+        cf.load(srclist=srclist)
+        return {'coadd':dict(cf),
+                'srclist':getattr(cf,'srclist',None)}
+
+    kw=dict(keys, srclist=srclist)
+    data=get_cache().cached('Coadd.load', (), kw, load)
+
+    cf.update(data['coadd'])
+    if srclist:
+        cf.srclist=data['srclist']
+
+    return cf
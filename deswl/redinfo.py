@@ -0,0 +1,279 @@
+"""
+A binary, memory mapped cache of the red info for a run.
+
+The red info for a full survey is hundreds of MB as json or yaml, and was
+parsed completely by every tool that used it.  Instead the red info is
+stored as a directory holding one .npy file per column
+
+    {flist_red}-cache/
+        meta.json
+        {column}.npy
+
+The columns are memory mapped on read, so only those used are read from
+disk, and rows can be selected by band or expname before anything else is
+read.
+
+Urls are stored in a string pool: the directories are listed once in
+meta.json, and the column holds the file name, with a {column}_dir column
+holding the index into the pool.
+
+    ri=RedInfo(fname)
+    w=ri.select(band='i')
+    data=ri.get_table(w)
+"""
+import os
+import json
+import shutil
+
+import numpy
+
+CACHE_SUFFIX='-cache'
+META_NAME='meta.json'
+DIR_SUFFIX='_dir'
+
+def get_cache_url(flist_url):
+    """
+    the cache directory corresponding to an eu.io red info file
+    """
+    base=os.path.splitext(flist_url)[0]
+    return base+CACHE_SUFFIX
+
+# values stored for None in string and numerical columns
+NULL_STRING=''
+NULL_NUMBER=-9999
+
+def make_red_table(red_info):
+    """
+    Convert a list of red info dicts to a structured array.  The columns are
+    the scalar entries found in any row; strings are stored at the maximum
+    length found.  None or missing entries are stored as NULL_STRING or
+    NULL_NUMBER
+    """
+    if len(red_info) == 0:
+        raise ValueError("no red info found")
+
+    kinds={}
+    for fd in red_info:
+        for name,val in fd.iteritems():
+            if val is None:
+                kinds.setdefault(name, None)
+                continue
+
+            kind=_get_kind(val)
+            prev=kinds.get(name,None)
+            if prev is None or prev == kind:
+                kinds[name]=kind
+            elif set([prev,kind]) == set(['i8','f8']):
+                kinds[name]='f8'
+            else:
+                # mixed or non-scalar entries are not kept
+                kinds[name]='skip'
+
+    names=[name for name in sorted(kinds) if kinds[name] not in [None,'skip']]
+
+    dt=[]
+    for name in names:
+        kind=kinds[name]
+        if kind == 'S':
+            slen=max(len(fd.get(name,None) or NULL_STRING) for fd in red_info)
+            dt.append( (name, 'S%d' % max(slen,1)) )
+        else:
+            dt.append( (name, kind) )
+
+    table=numpy.zeros(len(red_info), dtype=dt)
+    for name in names:
+        if kinds[name] == 'S':
+            null=NULL_STRING
+        else:
+            null=NULL_NUMBER
+
+        vals=[fd.get(name,None) for fd in red_info]
+        table[name] = [null if val is None else val for val in vals]
+
+    return table
+
+def _get_kind(val):
+    if isinstance(val, basestring):
+        return 'S'
+    elif isinstance(val, float):
+        return 'f8'
+    elif isinstance(val, (int,long)):
+        return 'i8'
+    else:
+        return 'skip'
+
+def write(cache_dir, red_info):
+    """
+    Write the red info to the cache, going through a temporary directory
+
+    parameters
+    ----------
+    cache_dir: string
+        The cache directory
+    red_info: list of dicts or array
+        The red info, e.g. from desdb.files.get_red_info_by_release
+    """
+    if isinstance(red_info, numpy.ndarray):
+        table=red_info
+    else:
+        table=make_red_table(red_info)
+
+    tmp_dir='%s.tmp-%d' % (cache_dir, os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    pool={}
+    dirs=[]
+    names=[]
+    pooled=[]
+    for name in table.dtype.names:
+        col=table[name]
+        if _is_url_column(col):
+            dir_idx,base=_pool_column(col, pool, dirs)
+            _write_column(tmp_dir, name+DIR_SUFFIX, dir_idx)
+            _write_column(tmp_dir, name, base)
+            pooled.append(name)
+        else:
+            _write_column(tmp_dir, name, col)
+        names.append(name)
+
+    meta={'nrows':table.size,
+          'names':names,
+          'pooled':pooled,
+          'dirs':dirs}
+    with open(os.path.join(tmp_dir, META_NAME),'w') as fobj:
+        json.dump(meta, fobj)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+def _is_url_column(col):
+    """
+    string columns where every entry has a directory
+    """
+    if col.dtype.kind != 'S' or col.size == 0:
+        return False
+    return numpy.char.find(col, '/').min() >= 0
+
+def _pool_column(col, pool, dirs):
+    """
+    split a url column into indices into the directory pool and
+    file names
+    """
+    split=[url.rsplit('/',1) for url in col.tolist()]
+
+    dir_idx=numpy.zeros(col.size, dtype='i4')
+    for i,(d,b) in enumerate(split):
+        idx=pool.get(d,None)
+        if idx is None:
+            idx=len(dirs)
+            pool[d]=idx
+            dirs.append(d)
+        dir_idx[i]=idx
+
+    base=numpy.array([b for d,b in split])
+    return dir_idx, base
+
+def _write_column(dir, name, col):
+    fname=os.path.join(dir, name+'.npy')
+    numpy.save(fname, numpy.ascontiguousarray(col))
+
+class RedInfo(object):
+    """
+    Read access to the red info cache
+
+    parameters
+    ----------
+    cache_dir: string
+        The cache directory written by write()
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir=cache_dir
+
+        with open(os.path.join(cache_dir, META_NAME)) as fobj:
+            meta=json.load(fobj)
+
+        self.nrows=meta['nrows']
+        self.names=[str(name) for name in meta['names']]
+        self.pooled=set(str(name) for name in meta['pooled'])
+        self.dirs=numpy.array([str(d) for d in meta['dirs']])
+
+        self._columns={}
+
+    def __len__(self):
+        return self.nrows
+
+    def select(self, band=None, expname=None):
+        """
+        indices of the rows with the given band(s) and expname(s)
+        """
+        ind=numpy.arange(self.nrows)
+        if band is not None:
+            ind=self._match(ind, 'band', band)
+        if expname is not None:
+            ind=self._match(ind, 'expname', expname)
+        return ind
+
+    def get_column(self, name, ind=None):
+        """
+        get a column, optionally for a subset of rows.  Urls are
+        expanded from the string pool
+        """
+        col=self._get_raw(name)
+        if ind is not None:
+            col=col[ind]
+        else:
+            col=numpy.array(col)
+
+        if name in self.pooled:
+            dir_idx=self._get_raw(name+DIR_SUFFIX)
+            if ind is not None:
+                dir_idx=dir_idx[ind]
+            dirs=numpy.char.add(self.dirs[dir_idx], '/')
+            col=numpy.char.add(dirs, col)
+
+        return col
+
+    def get_table(self, ind=None, columns=None):
+        """
+        get the red info as a structured array, optionally for a subset
+        of rows and columns
+        """
+        if columns is None:
+            columns=self.names
+
+        cols=[self.get_column(name, ind=ind) for name in columns]
+
+        dt=[(name,col.dtype.str) for name,col in zip(columns,cols)]
+        nrows=cols[0].size if len(cols) > 0 else 0
+        table=numpy.zeros(nrows, dtype=dt)
+        for name,col in zip(columns,cols):
+            table[name]=col
+        return table
+
+    def get_dicts(self, ind=None, columns=None):
+        """
+        get the red info as a list of dicts, as from
+        desdb.files.get_red_info_by_release
+        """
+        table=self.get_table(ind=ind, columns=columns)
+        names=table.dtype.names
+        return [dict(zip(names,row)) for row in table.tolist()]
+
+    def _match(self, ind, name, vals):
+        if isinstance(vals, basestring):
+            vals=[vals]
+        col=self._get_raw(name)[ind]
+        return ind[numpy.in1d(col, vals)]
+
+    def _get_raw(self, name):
+        col=self._columns.get(name,None)
+        if col is None:
+            if name not in self.names and not name.endswith(DIR_SUFFIX):
+                raise ValueError("no such column: '%s'" % name)
+            fname=os.path.join(self.cache_dir, name+'.npy')
+            col=numpy.load(fname, mmap_mode='r')
+            self._columns[name]=col
+        return col
@@ -0,0 +1,254 @@
+"""
+Predict job run times from the timings of completed runs.
+
+The job scripts write a line
+
+    time-seconds: $SECONDS
+
+to each job log.  These are harvested for successful jobs into a timing
+model for the run type
+
+    $DESDATA/wlpipe/timing/{run_type}-timing.json
+
+holding the band, tilename, number of objects and seconds for each job,
+grouped by run.  Harvesting a run again replaces its entries.
+
+Predictions are made at a chosen percentile.  For jobs with a known number
+of objects the seconds per object are used, otherwise the seconds per job.
+The samples for the same tile and band are used if there are enough of them,
+then those for the band, then all samples.
+
+To use the model when writing minions scripts, set walltime_percentile in
+the runconfig, e.g. 95
+"""
+import os
+import json
+from sys import stderr
+from multiprocessing.pool import ThreadPool
+
+import esutil as eu
+import deswl
+
+from .generic import NTHREADS
+
+# minimum number of samples to use a tile or band
+MIN_SAMPLES=5
+
+# bytes read from the end of each log
+LOG_TAIL_BYTES=4096
+
+def get_timing_dir():
+    d=deswl.files.get_wlpipe_dir()
+    return os.path.join(d, 'timing')
+
+def get_timing_url(run_type):
+    d=get_timing_dir()
+    name='%s-timing.json' % run_type
+    return os.path.join(d, name)
+
+def harvest(run, master=False, nthreads=NTHREADS):
+    """
+    harvest the job timings for a run into the model for its run type
+
+    parameters
+    ----------
+    run: string
+        The run identifier
+    master: bool, optional
+        The run was written in master mode.  Default False
+    nthreads: int, optional
+        Number of threads for reading the logs
+    """
+    from . import modules
+
+    cfobj,is_se=modules.get_scripts_maker(run, master=master)
+
+    model=TimingModel(cfobj.rc['run_type'])
+    records=get_run_timings(cfobj, nthreads=nthreads)
+    model.add_run(run, records)
+    model.write()
+
+    return model
+
+def get_run_timings(cfobj, nthreads=NTHREADS):
+    """
+    read the timings from the logs of the successful jobs in a run
+
+    returns
+    -------
+    A list of [band, tilename, nobj, seconds].  tilename and
+    nobj may be None
+    """
+    jobs=[]
+    for fd in cfobj.get_flists():
+        fd['run'] = cfobj['run']
+        cfobj.set_job_files(fd)
+        jobs.append(fd)
+
+    print >>stderr,'reading timings for',len(jobs),'jobs'
+
+    pool=ThreadPool(nthreads)
+    try:
+        times=pool.map(_read_job_seconds, jobs, chunksize=100)
+    finally:
+        pool.close()
+        pool.join()
+
+    records=[]
+    for fd,seconds in zip(jobs,times):
+        if seconds is None:
+            continue
+        records.append([get_band_key(fd.get('band',None)),
+                        fd.get('tilename',None),
+                        fd.get('nobj',None),
+                        seconds])
+
+    print >>stderr,'found timings for %d/%d jobs' % (len(records),len(jobs))
+    return records
+
+def read_log_seconds(log_file):
+    """
+    get the seconds from the last time-seconds line in the log, or None
+    """
+    try:
+        with open(log_file) as fobj:
+            fobj.seek(0, os.SEEK_END)
+            size=fobj.tell()
+            fobj.seek(max(0, size-LOG_TAIL_BYTES))
+            text=fobj.read()
+    except IOError:
+        return None
+
+    seconds=None
+    for line in text.split('\n'):
+        if line.startswith('time-seconds:'):
+            try:
+                seconds=float(line.split(':')[1])
+            except ValueError:
+                pass
+
+    return seconds
+
+def get_band_key(band):
+    if isinstance(band,list):
+        band=','.join(band)
+    return band
+
+def _read_job_seconds(fd):
+    """
+    the seconds for a successful job, else None
+    """
+    outf=fd['output_files']
+    try:
+        with open(outf['status']) as fobj:
+            exit_status=int(fobj.read())
+    except (IOError,ValueError):
+        return None
+
+    if exit_status != 0:
+        return None
+
+    return read_log_seconds(outf['log'])
+
+class TimingModel(dict):
+    """
+    Job timings for a run type, used to predict the time for new jobs
+
+    parameters
+    ----------
+    run_type: string
+        e.g. 'gfme'.  The model is read from the timing file if it
+        exists
+    """
+    def __init__(self, run_type):
+        self['run_type']=run_type
+        self['runs']={}
+
+        self.path=get_timing_url(run_type)
+        if os.path.exists(self.path):
+            print >>stderr,'reading timing model:',self.path
+            data=eu.io.read(self.path)
+            self['runs'].update(data['runs'])
+
+        self._make_index()
+
+    def add_run(self, run, records):
+        """
+        add or replace the records for a run
+        """
+        self['runs'][run]=records
+        self._make_index()
+
+    def write(self):
+        """
+        write the model, going through a temporary file
+        """
+        eu.ostools.makedirs_fromfile(self.path)
+
+        print >>stderr,'writing timing model:',self.path
+        tmp_path='%s.tmp-%d' % (self.path, os.getpid())
+        with open(tmp_path,'w') as fobj:
+            json.dump(dict(self), fobj)
+        os.rename(tmp_path, self.path)
+
+    def get_nsamples(self):
+        return sum(len(records) for records in self['runs'].itervalues())
+
+    def predict(self, fd, percentile=95.0):
+        """
+        predict the seconds for a job, or None if there are no samples
+
+        parameters
+        ----------
+        fd: dict
+            The job dict, with band and optionally tilename and nobj
+        percentile: float, optional
+            Percentile of the samples to use.  Default 95
+        """
+        band=get_band_key(fd.get('band',None))
+        tilename=fd.get('tilename',None)
+        nobj=fd.get('nobj',None)
+
+        if nobj is not None and nobj > 0:
+            rate=self._get_percentile(self._rates, band, tilename, percentile)
+            if rate is not None:
+                return rate*nobj
+
+        return self._get_percentile(self._times, band, tilename, percentile)
+
+    def _get_percentile(self, index, band, tilename, percentile):
+        import numpy
+
+        for key in [(band,tilename), (band,None), (None,None)]:
+            samples=index.get(key,None)
+            if samples is not None and len(samples) >= MIN_SAMPLES:
+                key_percentiles=self._percentiles.setdefault(id(index),{})
+                pkey=(key,percentile)
+                if pkey not in key_percentiles:
+                    key_percentiles[pkey]=numpy.percentile(samples, percentile)
+                return key_percentiles[pkey]
+
+        return None
+
+    def _make_index(self):
+        """
+        group the seconds per object and seconds per job by (band,tilename),
+        (band,None) and (None,None)
+        """
+        rates={}
+        times={}
+        for records in self['runs'].itervalues():
+            for band,tilename,nobj,seconds in records:
+                if nobj is not None and nobj > 0:
+                    index=rates
+                    val=seconds/float(nobj)
+                else:
+                    index=times
+                    val=seconds
+
+                for key in [(band,tilename), (band,None), (None,None)]:
+                    index.setdefault(key,[]).append(val)
+
+        self._rates=rates
+        self._times=times
+        self._percentiles={}
@@ -11,6 +11,9 @@ scripts= ['deswl-gen-meds-script',
           'deswl-gen-meds-all-release',
           'deswl-check-meds',
           'deswl-gen-gmix-condor',
+          'deswl-check-reduce',
+          'deswl-harvest-timing',
+          'deswl-exec',
           # deprecated
           #'deswl-gen-runconfig',
           #'deswl-gen-pbs',